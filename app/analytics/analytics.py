@@ -1,72 +1,253 @@
+import json
 import os
-from datetime import datetime
+from datetime import (
+    datetime,
+    timedelta,
+)
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 
+import sqlalchemy as sa
 from fastapi_utils.tasks import repeat_every
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 import app.analytics.rpc_client as dbt
-from app.core.config import BACKGROUND_TASK_ANALYTICS_INTERVAL
+from app.core.config import (
+    ANALYTICS_DELTA_IMPORT,
+    ANALYTICS_DELTA_IMPORT_OVERLAP,
+    ANALYTICS_FULL_IMPORT_INTERVAL,
+    BACKGROUND_TASK_ANALYTICS_INTERVAL,
+)
 from app.core.logging import logger
 from app.pg.util import get_postgres
+from .jobs import (
+    Progress,
+    enqueue,
+    task,
+)
+from .leases import leader_only
 from .resource_import import (
-    import_collections,
-    import_materials,
+    import_modified_resources,
+    import_resources,
 )
 
+RAW_TABLES = ("collections", "materials")
+STAGING_SUFFIX = "_staging"
+
 
 @repeat_every(seconds=BACKGROUND_TASK_ANALYTICS_INTERVAL, logger=logger)
-def background_task():
-    run()
+@leader_only("analytics", interval=BACKGROUND_TASK_ANALYTICS_INTERVAL)
+async def background_task():
+    await run_in_threadpool(enqueue, "analytics")
+
+
+@task("analytics")
+async def run(full: Optional[bool] = None, progress: Optional[Progress] = None):
+    """
+    Imports collections and materials from elastic and runs the dbt analytics.
+
+    The import is blocking and runs in the threadpool.
+    """
+    progress = progress or Progress()
+
+    progress.set("stage", "import")
+    await run_in_threadpool(run_import, full=full, progress=progress)
+
+    progress.set("stage", "dbt")
+    result = await dbt.run_analytics(progress=progress)
+    logger.info(f"Analytics: run took: {result.get('elapsed')}")
+
+
+def run_import(
+    full: Optional[bool] = None, progress: Optional[Progress] = None
+) -> Dict[str, int]:
+    """
+    Imports collections and materials from elastic.
 
+    A full import replaces the raw tables. Otherwise only resources modified
+    since the last import are upserted and deleted resources are removed.
+    Unless `full` is given, a full import is done if `ANALYTICS_DELTA_IMPORT` is
+    disabled, no import has been recorded yet or the last full import is older
+    than `ANALYTICS_FULL_IMPORT_INTERVAL`. Without a recorded import a full import
+    is done regardless of `full`.
 
-def run():
+    Returns the number of rows imported, changed and deleted per table, where
+    `<table> changed` counts the rows which have been added, removed or whose
+    document differs from the previous import.
+    """
     derived_at = datetime.now()
+    progress = progress or Progress()
 
     logger.info(f"{os.getpid()}: Starting analytics import at: {derived_at}")
 
     with next(get_postgres()) as session:
-        _backup_previous_run(session)
-
-        import_collections(session=session, derived_at=derived_at)
-        logger.info(
-            f"Analytics: after collections import: {len(session.new)} resources added to session"
-        )
-
-        import_materials(session=session, derived_at=derived_at)
-        logger.info(
-            f"Analytics: after materials import: {len(session.new)} resources added to session"
+        last_import, last_full_import = _last_imports(session)
+
+        if full is None:
+            full = (
+                not ANALYTICS_DELTA_IMPORT
+                or not last_full_import
+                or derived_at - last_full_import
+                > timedelta(seconds=ANALYTICS_FULL_IMPORT_INTERVAL)
+            )
+        elif not full and last_import is None:
+            logger.info(
+                "Analytics: no previous import recorded, running a full import"
+            )
+            full = True
+        progress.set("full_import", full)
+
+        if full:
+            _create_staging_tables(session)
+
+            counts = import_resources(
+                session=session,
+                derived_at=derived_at,
+                table_suffix=STAGING_SUFFIX,
+                progress=progress,
+            )
+            logger.info(f"Analytics: after resources import: {counts} rows copied")
+
+            _swap_staging_tables(session)
+            counts.update(_changed_rows(session))
+        else:
+            modified_since = last_import - timedelta(
+                seconds=ANALYTICS_DELTA_IMPORT_OVERLAP
+            )
+            logger.info(
+                f"Analytics: importing resources modified since {modified_since}"
+            )
+
+            counts = import_modified_resources(
+                session=session,
+                derived_at=derived_at,
+                modified_since=modified_since,
+                progress=progress,
+            )
+            logger.info(f"Analytics: after delta import: {counts}")
+
+        session.execute(
+            sa.text(
+                """
+                insert into store.analytics_imports (derived_at, full_import, counts)
+                values (:derived_at, :full_import, cast(:counts as jsonb))
+                """
+            ),
+            {
+                "derived_at": derived_at,
+                "full_import": full,
+                "counts": json.dumps(counts),
+            },
         )
 
         session.commit()
 
     logger.info(f"Finished analytics import at: {datetime.now()}")
 
-    result = dbt.run_analytics()
-    logger.info(f"Analytics: run started {result}")
-    #
-    result = dbt.poll(request_token=result["request_token"])
-    logger.info(f"Analytics: run took: {result.get('elapsed')}")
-
+    return counts
 
-def _backup_previous_run(session: Session):
-    logger.info(f"Analytics: copying previous import data to backup tables")
 
+def _last_imports(
+    session: Session,
+) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """ Returns the `derived_at` of the last successful import and full import """
     session.execute(
         """
-        drop table if exists raw.collections_previous_run cascade;
-        create table raw.collections_previous_run
-        as table raw.collections;
-        truncate raw.collections;
+        create table if not exists store.analytics_imports (
+            derived_at timestamp primary key,
+            full_import boolean not null,
+            counts jsonb
+        );
         """
     )
-    logger.info(f"Analytics: copied collections to collections_previous_run")
-
-    session.execute(
+    row = session.execute(
         """
-        drop table if exists raw.materials_previous_run cascade;
-        create table raw.materials_previous_run
-        as table raw.materials;
-        truncate raw.materials;
+        select max(derived_at) as last_import,
+               max(derived_at) filter (where full_import) as last_full_import
+        from store.analytics_imports
         """
+    ).one()
+
+    return row.last_import, row.last_full_import
+
+
+def _create_staging_tables(session: Session):
+    for name in RAW_TABLES:
+        session.execute(
+            f"""
+            drop table if exists raw.{name}{STAGING_SUFFIX};
+            create table raw.{name}{STAGING_SUFFIX}
+            (like raw.{name} including all);
+            """
+        )
+    logger.info(f"Analytics: created staging tables")
+
+
+def _swap_staging_tables(session: Session):
+    """
+    Replaces the raw tables by the freshly loaded staging tables, keeping
+    the current generation as `*_previous_run` instead of copying it.
+
+    Views bind to tables rather than their names, so the views depending on
+    a raw table are recreated against the new one. The previous run is
+    dropped without cascade, a remaining dependency fails the import instead
+    of being dropped silently.
+
+    Runs in the transaction of the import, so readers only ever see
+    either the previous or the complete new import.
+    """
+    for name in RAW_TABLES:
+        views = _dependent_views(session, f"raw.{name}")
+        session.execute(
+            f"""
+            drop table if exists raw.{name}_previous_run;
+            alter table raw.{name} rename to {name}_previous_run;
+            alter table raw.{name}{STAGING_SUFFIX} rename to {name};
+            """
+        )
+        for view, definition in views:
+            # executed without parameters, the definition may contain colons
+            session.connection().exec_driver_sql(
+                f"create or replace view {view} as {definition}"
+            )
+    logger.info(f"Analytics: swapped staging tables into place")
+
+
+def _changed_rows(session: Session) -> Dict[str, int]:
+    """ Counts the rows of a full import which differ from the previous run """
+    counts = {}
+    for name in RAW_TABLES:
+        counts[f"raw.{name} changed"] = session.execute(
+            f"""
+            select count(*) from raw.{name} n
+            full join raw.{name}_previous_run o on o.id = n.id
+            where n.doc::jsonb is distinct from o.doc::jsonb
+            """
+        ).scalar()
+    return counts
+
+
+def _dependent_views(session: Session, table: str) -> List[Tuple[str, str]]:
+    """ Returns the names and definitions of the views selecting from `table` """
+    rows = session.execute(
+        sa.text(
+            """
+            select distinct v.oid::regclass::text as view,
+                   pg_get_viewdef(v.oid) as definition
+            from pg_depend d
+            join pg_rewrite r on r.oid = d.objid
+            join pg_class v on v.oid = r.ev_class
+            where d.classid = 'pg_rewrite'::regclass
+              and d.refobjid = cast(:table as regclass)
+              and v.oid <> d.refobjid
+              and v.relkind = 'v'
+            """
+        ),
+        {"table": table},
     )
-    logger.info(f"Analytics: copied materials to materials_previous_run")
+    return [(row.view, row.definition) for row in rows]
@@ -0,0 +1,371 @@
+"""md
+# Background jobs
+
+Runs of the analytics, search stats and spellcheck are queued as jobs in
+`store.jobs` and executed by the job worker of any gunicorn worker:
+
+- at most one job per task is queued or running, enqueueing a task again
+  returns the existing job
+- the worker claims the oldest queued job with `for update skip locked`,
+  so each job is executed by exactly one worker
+- jobs of conflicting tasks, see `CONFLICTS`, don't run at the same time, so
+  e.g. the search stats never read the raw tables while they are replaced by
+  an import; other jobs run concurrently
+- while a job is running, the worker records its progress counters and a
+  heartbeat; jobs without a heartbeat for `BACKGROUND_TASK_LEASE_TTL` seconds,
+  e.g. after a worker crash, are queued again up to `JOBS_MAX_ATTEMPTS` times,
+  jobs cancelled by a worker shutdown right away
+"""
+
+import asyncio
+import json
+import os
+import socket
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import sqlalchemy as sa
+from fastapi_utils.tasks import repeat_every
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import (
+    BACKGROUND_TASK_LEASE_TTL,
+    JOBS_MAX_ATTEMPTS,
+    JOBS_POLL_INTERVAL,
+)
+from app.core.logging import logger
+from app.pg.util import get_postgres
+
+# identifies this worker process across replicas
+WORKER = f"{socket.gethostname()}:{os.getpid()}"
+
+TASKS: Dict[str, Callable] = {}
+
+# tasks which must not run at the same time as the task; the spellcheck claims
+# the texts it checks, see `spellcheck._claimed_batches`, and conflicts with none
+CONFLICTS: Dict[str, Tuple[str, ...]] = {
+    "analytics": ("pipeline", "search_stats"),
+    "pipeline": ("analytics", "search_stats"),
+    "search_stats": ("analytics", "pipeline"),
+}
+
+# jobs executed by this worker, referenced until they have finished
+_running: Set[asyncio.Task] = set()
+
+_table_created = False
+
+
+class Progress:
+    """ Progress counters of a running job, updated from any thread """
+
+    def __init__(self):
+        self._values: Dict[str, Any] = {}
+        self._lock = Lock()
+
+    def add(self, counter: str, n: int = 1):
+        with self._lock:
+            self._values[counter] = self._values.get(counter, 0) + n
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._values[key] = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._values)
+
+
+def task(name: str) -> Callable:
+    """
+    Registers a function as the job task `name`. It is called with the
+    params of the job and a `Progress`; a sync function is run in the
+    threadpool.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        TASKS[name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(name: str, **params) -> Tuple[dict, bool]:
+    """
+    Queues a job for the task unless one is queued or running already.
+
+    Returns the new or the existing job and whether it has been created.
+    """
+    with next(get_postgres()) as session:
+        _create_table(session)
+        while True:
+            row = session.execute(
+                sa.text(
+                    """
+                    insert into store.jobs (task, params)
+                    values (:task, cast(:params as jsonb))
+                    on conflict (task) where state in ('queued', 'running')
+                    do nothing
+                    returning *
+                    """
+                ),
+                {"task": name, "params": json.dumps(params)},
+            ).one_or_none()
+            if row:
+                session.commit()
+                logger.info(f"Jobs: queued {name} job {row.id} with {params}")
+                return dict(row._mapping), True
+
+            row = session.execute(
+                sa.text(
+                    """
+                    select * from store.jobs
+                    where task = :task and state in ('queued', 'running')
+                    """
+                ),
+                {"task": name},
+            ).one_or_none()
+            # retry if the conflicting job has finished in the meantime
+            if row:
+                session.commit()
+                return dict(row._mapping), False
+
+
+def get_job(job_id: int) -> Optional[dict]:
+    with next(get_postgres()) as session:
+        _create_table(session)
+        row = session.execute(
+            sa.text("select * from store.jobs where id = :id"), {"id": job_id}
+        ).one_or_none()
+        return dict(row._mapping) if row else None
+
+
+def get_jobs(
+    name: Optional[str] = None, state: Optional[str] = None, limit: int = 50
+) -> List[dict]:
+    """ Returns the most recently queued jobs, optionally of a task and state """
+    with next(get_postgres()) as session:
+        _create_table(session)
+        rows = session.execute(
+            sa.text(
+                """
+                select * from store.jobs
+                where (cast(:task as text) is null or task = :task)
+                  and (cast(:state as text) is null or state = :state)
+                order by id desc
+                limit :limit
+                """
+            ),
+            {"task": name, "state": state, "limit": limit},
+        )
+        return [dict(row._mapping) for row in rows]
+
+
+@repeat_every(seconds=JOBS_POLL_INTERVAL, logger=logger)
+async def worker():
+    """ Starts executing queued jobs until no job can be claimed anymore """
+    while True:
+        job = await run_in_threadpool(_claim)
+        if not job:
+            return
+
+        execution = asyncio.ensure_future(_execute(job))
+        _running.add(execution)
+        execution.add_done_callback(_running.discard)
+
+
+async def _execute(job: dict):
+    func = TASKS[job["task"]]
+    progress = Progress()
+    heartbeat = asyncio.ensure_future(_heartbeat(job["id"], progress))
+
+    logger.info(f"Jobs: {WORKER} running {job['task']} job {job['id']}")
+    try:
+        if asyncio.iscoroutinefunction(func):
+            await func(progress=progress, **job["params"])
+        else:
+            await run_in_threadpool(func, progress=progress, **job["params"])
+    except asyncio.CancelledError:
+        # e.g. on shutdown, blocking since the threadpool may be gone already
+        logger.warning(f"Jobs: {job['task']} job {job['id']} cancelled, re-queueing")
+        _requeue(job["id"], progress)
+        raise
+    except Exception as e:
+        logger.exception(f"Jobs: {job['task']} job {job['id']} failed")
+        await run_in_threadpool(_finish, job["id"], "failed", progress, str(e))
+    else:
+        await run_in_threadpool(_finish, job["id"], "succeeded", progress)
+        logger.info(f"Jobs: {job['task']} job {job['id']} succeeded")
+    finally:
+        heartbeat.cancel()
+
+
+async def _heartbeat(job_id: int, progress: Progress):
+    while True:
+        await asyncio.sleep(BACKGROUND_TASK_LEASE_TTL / 3)
+        try:
+            await run_in_threadpool(_update_progress, job_id, progress)
+        except Exception as e:
+            logger.error(f"Jobs: heartbeat of job {job_id} failed: {e}")
+
+
+def _claim() -> Optional[dict]:
+    """
+    Marks the oldest queued job as running by this worker and returns it,
+    after re-queueing running jobs whose worker has stopped sending heartbeats.
+
+    Jobs are not claimed while a job of a conflicting task is running. Claims
+    are serialized by an advisory lock, so two workers cannot claim
+    conflicting jobs at the same time.
+    """
+    with next(get_postgres()) as session:
+        _create_table(session)
+        session.execute("select pg_advisory_xact_lock(hashtext('store.jobs'))")
+        session.execute(
+            sa.text(
+                """
+                update store.jobs
+                set state = case when attempts < :max_attempts
+                                 then 'queued' else 'failed' end,
+                    error = 'worker ' || worker || ' stopped sending heartbeats',
+                    finished_at = case when attempts < :max_attempts
+                                       then null else now() end
+                where state = 'running'
+                  and heartbeat_at < now() - make_interval(secs => :ttl)
+                """
+            ),
+            {"ttl": BACKGROUND_TASK_LEASE_TTL, "max_attempts": JOBS_MAX_ATTEMPTS},
+        )
+        row = session.execute(
+            sa.text(
+                """
+                update store.jobs
+                set state = 'running', worker = :worker, attempts = attempts + 1,
+                    started_at = now(), heartbeat_at = now()
+                where id = (
+                    select id from store.jobs j
+                    where state = 'queued' and task = any(:tasks)
+                      and not exists (
+                          select from store.jobs r
+                          where r.state = 'running'
+                            and r.task in (
+                                select jsonb_array_elements_text(
+                                    cast(:conflicts as jsonb) -> j.task
+                                )
+                            )
+                      )
+                    order by id
+                    for update skip locked
+                    limit 1
+                )
+                returning *
+                """
+            ),
+            {
+                "worker": WORKER,
+                "tasks": list(TASKS),
+                "conflicts": json.dumps(CONFLICTS),
+            },
+        ).one_or_none()
+        session.commit()
+
+    return dict(row._mapping) if row else None
+
+
+def _update_progress(job_id: int, progress: Progress):
+    with next(get_postgres()) as session:
+        session.execute(
+            sa.text(
+                """
+                update store.jobs
+                set progress = cast(:progress as jsonb), heartbeat_at = now()
+                where id = :id and worker = :worker and state = 'running'
+                """
+            ),
+            {
+                "id": job_id,
+                "worker": WORKER,
+                "progress": json.dumps(progress.snapshot(), default=str),
+            },
+        )
+        session.commit()
+
+
+def _finish(job_id: int, state: str, progress: Progress, error: str = None):
+    with next(get_postgres()) as session:
+        session.execute(
+            sa.text(
+                """
+                update store.jobs
+                set state = :state, error = :error,
+                    progress = cast(:progress as jsonb), finished_at = now()
+                where id = :id and worker = :worker
+                """
+            ),
+            {
+                "id": job_id,
+                "worker": WORKER,
+                "state": state,
+                "error": error,
+                "progress": json.dumps(progress.snapshot(), default=str),
+            },
+        )
+        session.commit()
+
+
+def _requeue(job_id: int, progress: Progress):
+    with next(get_postgres()) as session:
+        session.execute(
+            sa.text(
+                """
+                update store.jobs
+                set state = 'queued', error = 'worker ' || worker || ' was stopped',
+                    progress = cast(:progress as jsonb)
+                where id = :id and worker = :worker and state = 'running'
+                """
+            ),
+            {
+                "id": job_id,
+                "worker": WORKER,
+                "progress": json.dumps(progress.snapshot(), default=str),
+            },
+        )
+        session.commit()
+
+
+def _create_table(session: Session):
+    """ Creates the jobs table once per process, commits the session """
+    global _table_created
+    if _table_created:
+        return
+
+    session.execute(
+        """
+        create table if not exists store.jobs (
+            id bigserial primary key,
+            task text not null,
+            params jsonb not null default '{}',
+            state text not null default 'queued',
+            progress jsonb not null default '{}',
+            error text,
+            worker text,
+            attempts int not null default 0,
+            queued_at timestamp not null default now(),
+            started_at timestamp,
+            heartbeat_at timestamp,
+            finished_at timestamp
+        );
+        create unique index if not exists jobs_active_task
+        on store.jobs (task) where state in ('queued', 'running');
+        """
+    )
+    session.commit()
+    _table_created = True
@@ -0,0 +1,119 @@
+"""md
+# Background task schedules
+
+Every gunicorn worker of every replica registers the periodic background
+tasks, which only enqueue a job, see `app.analytics.jobs`. To enqueue each of
+them only once per interval, a worker has to claim the interval of the task in
+`store.background_tasks` first: the claim succeeds if the task has not been
+started within its interval.
+
+Claiming is a single upsert, so of concurrent workers at most one wins. The
+worker executing the job is recorded by the job itself.
+"""
+
+import asyncio
+import os
+import socket
+from functools import wraps
+from typing import (
+    Callable,
+    List,
+)
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.logging import logger
+from app.pg.util import get_postgres
+
+# identifies this worker process across replicas
+HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+_table_created = False
+
+
+def leader_only(name: str, interval: int) -> Callable:
+    """
+    Decorates a background task to run only if the interval of `name` could be
+    claimed, i.e. at most once per `interval` seconds across all workers.
+
+    The decorated task is a coroutine function; a sync task is run in the
+    threadpool.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper():
+            if not await run_in_threadpool(acquire, name, interval):
+                logger.debug(f"Leases: {name} is not due, skipping")
+                return
+
+            logger.info(f"Leases: {HOLDER} started {name}")
+            if asyncio.iscoroutinefunction(func):
+                await func()
+            else:
+                await run_in_threadpool(func)
+
+        return wrapper
+
+    return decorator
+
+
+def acquire(name: str, interval: int) -> bool:
+    with next(get_postgres()) as session:
+        _create_table(session)
+        row = session.execute(
+            sa.text(
+                """
+                insert into store.background_tasks (name, holder, last_started_at)
+                values (:name, :holder, now())
+                on conflict (name) do update
+                set holder = excluded.holder,
+                    last_started_at = excluded.last_started_at
+                where background_tasks.last_started_at is null
+                    or background_tasks.last_started_at
+                        <= now() - make_interval(secs => :interval)
+                returning holder
+                """
+            ),
+            {"name": name, "holder": HOLDER, "interval": interval},
+        ).one_or_none()
+        session.commit()
+
+    return row is not None
+
+
+def holders() -> List[dict]:
+    """ Returns when and by which process each background task was last started """
+    with next(get_postgres()) as session:
+        _create_table(session)
+        rows = session.execute(
+            sa.text(
+                """
+                select name, holder as started_by, last_started_at
+                from store.background_tasks
+                order by name
+                """
+            )
+        )
+        return [dict(row._mapping) for row in rows]
+
+
+def _create_table(session: Session):
+    """ Creates the table once per process, commits the session """
+    global _table_created
+    if _table_created:
+        return
+
+    session.execute(
+        """
+        create table if not exists store.background_tasks (
+            name text primary key,
+            holder text,
+            last_started_at timestamp
+        );
+        """
+    )
+    session.commit()
+    _table_created = True
@@ -0,0 +1,239 @@
+"""md
+# Analytics pipeline
+
+Runs the analytics as dependent stages:
+
+```
+import ─┬─> dbt ──> spellcheck
+        └─> search stats
+```
+
+A stage starts as soon as all its dependencies have finished, so the search
+stats run concurrently to dbt and the spellcheck.
+
+Every stage produces an output version. The import produces a new version
+only if it has added, changed or removed any documents, every other stage
+passes on the versions of its inputs. A stage is skipped if its input versions
+are the ones of its last successful run, recorded with its duration in
+`store.pipeline_stages`.
+"""
+
+import asyncio
+import json
+from datetime import datetime
+from time import monotonic
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Optional,
+    Tuple,
+)
+
+import sqlalchemy as sa
+from fastapi_utils.tasks import repeat_every
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import app.analytics.analytics as analytics
+import app.analytics.rpc_client as dbt
+import app.analytics.search_stats as search_stats
+import app.analytics.spellcheck as spellcheck
+from app.core.config import BACKGROUND_TASK_PIPELINE_INTERVAL
+from app.core.logging import logger
+from app.pg.util import get_postgres
+from .jobs import (
+    Progress,
+    enqueue,
+    task,
+)
+from .leases import leader_only
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[..., Awaitable[Optional[str]]],
+        deps: Tuple[str, ...] = (),
+    ):
+        """
+        `func` is called with the params of the pipeline and returns a new
+        output version, or `None` if the output has not changed.
+        """
+        self.name = name
+        self.func = func
+        self.deps = deps
+
+
+async def _import(full: Optional[bool], progress: Progress) -> Optional[str]:
+    counts = await run_in_threadpool(analytics.run_import, full=full, progress=progress)
+    # re-imported unchanged documents don't change the output
+    changes = [
+        count
+        for key, count in counts.items()
+        if key.endswith((" changed", " deleted"))
+    ]
+    if any(changes):
+        return datetime.now().isoformat()
+
+
+async def _dbt(progress: Progress, **_) -> Optional[str]:
+    await dbt.run_analytics(progress=progress)
+
+
+async def _search_stats(progress: Progress, **_) -> Optional[str]:
+    await search_stats.run(progress=progress)
+
+
+async def _spellcheck(progress: Progress, **_) -> Optional[str]:
+    await spellcheck.run(progress=progress)
+
+
+STAGES = (
+    Stage("import", _import),
+    Stage("dbt", _dbt, deps=("import",)),
+    Stage("search_stats", _search_stats, deps=("import",)),
+    Stage("spellcheck", _spellcheck, deps=("dbt",)),
+)
+
+
+@repeat_every(seconds=BACKGROUND_TASK_PIPELINE_INTERVAL, logger=logger)
+@leader_only("pipeline", interval=BACKGROUND_TASK_PIPELINE_INTERVAL)
+async def background_task():
+    await run_in_threadpool(enqueue, "pipeline")
+
+
+@task("pipeline")
+async def run(
+    full: Optional[bool] = None,
+    force: bool = False,
+    progress: Optional[Progress] = None,
+):
+    """
+    Runs the stages of the pipeline, skipping stages with unchanged inputs
+    unless `force` is given.
+
+    The state and duration of every stage are reported as `stages` in
+    `progress`. Stages depending on a failed stage are not run, the
+    pipeline fails after all other stages have finished.
+    """
+    progress = progress or Progress()
+    last_runs = await run_in_threadpool(_last_runs)
+
+    stages: Dict[str, dict] = {}
+    versions: Dict[str, asyncio.Future] = {
+        stage.name: asyncio.get_event_loop().create_future() for stage in STAGES
+    }
+
+    def report(stage: Stage, **values):
+        stages.setdefault(stage.name, {}).update(values)
+        progress.set("stages", {name: dict(state) for name, state in stages.items()})
+
+    async def run_stage(stage: Stage):
+        try:
+            inputs = {dep: await versions[dep] for dep in stage.deps}
+        except Exception:
+            report(stage, state="not run")
+            versions[stage.name].set_exception(
+                RuntimeError(f"dependency of {stage.name} failed")
+            )
+            return
+
+        input_version = json.dumps(inputs, sort_keys=True)
+        last_run = last_runs.get(stage.name)
+        if stage.deps and not force and last_run:
+            if last_run["input_version"] == input_version:
+                report(stage, state="skipped")
+                versions[stage.name].set_result(last_run["output_version"])
+                return
+
+        report(stage, state="running")
+        start = monotonic()
+        try:
+            output_version = await stage.func(full=full, progress=progress)
+            duration = monotonic() - start
+            if output_version is None:
+                if stage.deps:
+                    output_version = input_version
+                elif last_run:
+                    output_version = last_run["output_version"]
+                else:
+                    output_version = datetime.now().isoformat()
+
+            await run_in_threadpool(
+                _record_run, stage.name, input_version, output_version, duration
+            )
+        except Exception as e:
+            logger.exception(f"Pipeline: stage {stage.name} failed")
+            report(stage, state="failed", duration=monotonic() - start, error=str(e))
+            versions[stage.name].set_exception(e)
+            return
+
+        report(stage, state="succeeded", duration=duration)
+        logger.info(f"Pipeline: stage {stage.name} took {duration:.1f}s")
+        versions[stage.name].set_result(output_version)
+
+    tasks = [asyncio.ensure_future(run_stage(stage)) for stage in STAGES]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # don't leave stages running or waiting on a dependency behind
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # retrieve all exceptions, so none is logged as never retrieved
+    failed = [
+        name
+        for name, version in versions.items()
+        if version.exception() and stages[name]["state"] == "failed"
+    ]
+    if failed:
+        raise RuntimeError(f"Pipeline: stages {', '.join(failed)} failed")
+
+
+def _last_runs() -> Dict[str, dict]:
+    with next(get_postgres()) as session:
+        _create_table(session)
+        rows = session.execute("select * from store.pipeline_stages")
+        return {row.name: dict(row._mapping) for row in rows}
+
+
+def _record_run(name: str, input_version: str, output_version: str, duration: float):
+    with next(get_postgres()) as session:
+        session.execute(
+            sa.text(
+                """
+                insert into store.pipeline_stages
+                    (name, input_version, output_version, finished_at, duration)
+                values (:name, :input_version, :output_version, now(), :duration)
+                on conflict (name) do update
+                set input_version = excluded.input_version,
+                    output_version = excluded.output_version,
+                    finished_at = excluded.finished_at,
+                    duration = excluded.duration
+                """
+            ),
+            {
+                "name": name,
+                "input_version": input_version,
+                "output_version": output_version,
+                "duration": duration,
+            },
+        )
+        session.commit()
+
+
+def _create_table(session: Session):
+    session.execute(
+        """
+        create table if not exists store.pipeline_stages (
+            name text primary key,
+            input_version text not null,
+            output_version text not null,
+            finished_at timestamp not null,
+            duration double precision not null
+        );
+        """
+    )
@@ -0,0 +1,117 @@
+"""md
+# Source projection
+
+Declares which parts of the elastic `_source` of collections and materials
+the analytics import stores in the `doc` column of `raw.collections` and
+`raw.materials`.
+
+If `ANALYTICS_IMPORT_PROJECTION` is enabled, only the structural fields and
+the properties backing a `ResourceField` are included, instead of all
+`properties.*`. It is disabled by default, since dbt models reading any other
+property would silently get nulls.
+"""
+
+import json
+from typing import (
+    Dict,
+    List,
+)
+
+from app.core.config import (
+    ANALYTICS_IMPORT_EXTRA_FIELDS,
+    ANALYTICS_IMPORT_PROJECTION,
+)
+from app.core.logging import logger
+from app.elastic import (
+    Field,
+    Search,
+)
+from app.models.collection import CollectionAttribute
+from app.models.learning_material import LearningMaterialAttribute
+from app.pg.metadata import (
+    ResourceField,
+    ResourceType,
+)
+
+# number of hits sampled to estimate the size saved by the projection
+SAMPLE_SIZE = 100
+
+BASE_INCLUDES: Dict[ResourceType, List[str]] = {
+    ResourceType.COLLECTION: ["type", "aspects", "nodeRef.*", "path"],
+    ResourceType.MATERIAL: ["type", "aspects", "nodeRef.*", "collections.nodeRef.id"],
+}
+
+RESOURCE_FIELDS: Dict[ResourceType, Dict[ResourceField, Field]] = {
+    ResourceType.COLLECTION: {
+        ResourceField.TITLE: CollectionAttribute.TITLE,
+        ResourceField.DESCRIPTION: CollectionAttribute.DESCRIPTION,
+        ResourceField.KEYWORDS: CollectionAttribute.KEYWORDS,
+        ResourceField.EDU_CONTEXT: CollectionAttribute.EDU_CONTEXT,
+    },
+    ResourceType.MATERIAL: {
+        ResourceField.TITLE: LearningMaterialAttribute.TITLE,
+        ResourceField.DESCRIPTION: LearningMaterialAttribute.DESCRIPTION,
+        ResourceField.KEYWORDS: LearningMaterialAttribute.KEYWORDS,
+        ResourceField.EDU_CONTEXT: LearningMaterialAttribute.EDU_CONTEXT,
+        ResourceField.TAXON_ID: LearningMaterialAttribute.SUBJECTS,
+        ResourceField.LEARNING_RESOURCE_TYPE: (
+            LearningMaterialAttribute.LEARNINGRESOURCE_TYPE
+        ),
+        ResourceField.LICENSE: LearningMaterialAttribute.LICENSES,
+        ResourceField.ADS_QUALIFIER: LearningMaterialAttribute.CONTAINS_ADS,
+        ResourceField.OBJECT_TYPE: LearningMaterialAttribute.OBJECT_TYPE,
+        ResourceField.INTENDED_ENDUSER_ROLE: LearningMaterialAttribute.EDUENDUSERROLE,
+        ResourceField.URL: LearningMaterialAttribute.WWW_URL,
+        ResourceField.REPLICATION_SOURCE: LearningMaterialAttribute.REPLICATION_SOURCE,
+        ResourceField.REPLICATION_SOURCE_ID: (
+            LearningMaterialAttribute.REPLICATION_SOURCE_ID
+        ),
+    },
+}
+
+
+def source_includes(
+    resource_type: ResourceType, projection: bool = ANALYTICS_IMPORT_PROJECTION
+) -> List[str]:
+    """
+    Returns the `_source` includes for the import of the resource type:
+    all properties if `projection` is disabled, otherwise only the properties
+    declared in `RESOURCE_FIELDS` plus `ANALYTICS_IMPORT_EXTRA_FIELDS`.
+    """
+    includes = list(BASE_INCLUDES[resource_type])
+    if not projection:
+        return includes + ["properties.*"]
+
+    includes += [field.path for field in RESOURCE_FIELDS[resource_type].values()]
+    includes += [field for field in ANALYTICS_IMPORT_EXTRA_FIELDS if field]
+    return list(dict.fromkeys(includes))
+
+
+def projected_ratio(s: Search) -> float:
+    """
+    Estimates the size of documents projected by the search relative to
+    documents with all properties, from the serialized sources of a sample.
+    """
+    projected = s[:SAMPLE_SIZE].execute_raw()["hits"]["hits"]
+    if not projected:
+        return 1.0
+
+    full = (
+        s.source(includes=s._source["includes"] + ["properties.*"])
+        .filter("ids", values=[hit["_id"] for hit in projected])[:SAMPLE_SIZE]
+        .execute_raw()["hits"]["hits"]
+    )
+
+    def size(hits: List[dict]) -> int:
+        return sum(len(json.dumps(hit["_source"])) for hit in hits)
+
+    return size(projected) / (size(full) or 1)
+
+
+def log_savings(name: str, copied_bytes: int, ratio: float):
+    saved = copied_bytes / ratio - copied_bytes if ratio else 0
+    logger.info(
+        f"Analytics: copied {copied_bytes / 2 ** 20:.1f} MiB of {name} documents,"
+        f" source projection saved ~{saved / 2 ** 20:.1f} MiB"
+        f" ({1 - ratio:.0%} of the full documents)"
+    )
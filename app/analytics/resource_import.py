@@ -1,60 +1,350 @@
+import csv
+import io
+import json
 from datetime import datetime
+from queue import (
+    Full,
+    Queue,
+)
+from threading import (
+    Event,
+    Thread,
+)
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
+import sqlalchemy as sa
 from sqlalchemy.orm import Session
 
-from app.core.config import PORTAL_ROOT_ID
+from app.core.config import (
+    ANALYTICS_IMPORT_BATCH_SIZE,
+    ANALYTICS_IMPORT_PROJECTION,
+    ANALYTICS_IMPORT_SLICES,
+    PORTAL_ROOT_ID,
+)
+from app.core.logging import logger
 from app.crud.elastic import (
     query_collections,
     query_materials,
 )
-from app.elastic import Search
+from app.elastic import (
+    Search,
+    qrange,
+)
+from app.models.elastic import ElasticResourceAttribute
 from app.pg.metadata import (
     Collection,
     Material,
+    ResourceType,
+)
+from .jobs import Progress
+from .projection import (
+    log_savings,
+    projected_ratio,
+    source_includes,
 )
 
+_COPY_COLUMNS = ("id", "doc", "derived_at")
+
+# sentinel put on the queue by a slice once it is exhausted
+_DONE = object()
 
-def import_collections(session: Session, derived_at: datetime):
-    s = (
+
+_RESOURCE_TYPES: Dict[sa.Table, ResourceType] = {
+    Collection.__table__: ResourceType.COLLECTION,
+    Material.__table__: ResourceType.MATERIAL,
+}
+
+_QUERIES = {
+    ResourceType.COLLECTION: query_collections,
+    ResourceType.MATERIAL: query_materials,
+}
+
+
+def _search(resource_type: ResourceType) -> Search:
+    return (
         Search()
-        .query(query_collections(ancestor_id=PORTAL_ROOT_ID))
-        .source(includes=["type", "aspects", "properties.*", "nodeRef.*", "path"])
+        .query(_QUERIES[resource_type](ancestor_id=PORTAL_ROOT_ID))
+        .source(includes=source_includes(resource_type))
     )
 
-    seen = set()
-    for hit in s.scan():
-        if hit.nodeRef["id"] in seen:
-            continue
 
-        seen.add(hit.nodeRef["id"])
+def import_resources(
+    session: Session,
+    derived_at: datetime,
+    slices: int = ANALYTICS_IMPORT_SLICES,
+    batch_size: int = ANALYTICS_IMPORT_BATCH_SIZE,
+    table_suffix: str = "",
+    progress: Optional[Progress] = None,
+) -> Dict[str, int]:
+    """
+    Imports collections and materials into `raw.collections` / `raw.materials`.
 
-        session.add(
-            Collection(id=hit.nodeRef["id"], doc=hit.to_dict(), derived_at=derived_at)
-        )
+    Both are fetched in parallel, each with `slices` concurrent sliced scrolls.
+    Hits are de-duplicated and loaded by the calling thread with
+    `COPY ... FROM STDIN` in batches of `batch_size`, on the connection of the
+    session, i.e. within its transaction. With `table_suffix`, rows are loaded
+    into e.g. `raw.collections_staging` instead. The copied documents are
+    counted as `documents_imported` in `progress`.
 
+    Returns the number of rows copied per table.
+    """
+    searches = {
+        f"{table.schema}.{table.name}{table_suffix}": _search(resource_type)
+        for table, resource_type in _RESOURCE_TYPES.items()
+    }
+    ratios = _projected_ratios(searches)
 
-def import_materials(session: Session, derived_at: datetime):
-    s = (
-        Search()
-        .query(query_materials(ancestor_id=PORTAL_ROOT_ID))
-        .source(
-            includes=[
-                "type",
-                "aspects",
-                "properties.*",
-                "nodeRef.*",
-                "collections.nodeRef.id",
-            ]
+    counts, sizes = _copy_hits(
+        session,
+        searches=searches,
+        derived_at=derived_at,
+        slices=slices,
+        batch_size=batch_size,
+        progress=progress,
+    )
+    _log_savings(sizes, ratios)
+
+    return counts
+
+
+def import_modified_resources(
+    session: Session,
+    derived_at: datetime,
+    modified_since: datetime,
+    slices: int = ANALYTICS_IMPORT_SLICES,
+    batch_size: int = ANALYTICS_IMPORT_BATCH_SIZE,
+    progress: Optional[Progress] = None,
+) -> Dict[str, int]:
+    """
+    Incrementally updates `raw.collections` / `raw.materials`.
+
+    Resources modified since `modified_since` are upserted, resources which
+    are not in the index anymore are deleted. Deletions are detected by
+    comparing against the ids of all indexed resources, which are scrolled
+    in parallel to the modified resources. Rows whose document is unchanged
+    are left as they are.
+
+    Returns the number of rows inserted or changed and deleted per table.
+    """
+    searches = {}
+    ids_only = set()
+    for table, resource_type in _RESOURCE_TYPES.items():
+        session.execute(
+            f"""
+            create temp table {table.name}_delta
+            (like {table.schema}.{table.name} including defaults) on commit drop;
+            create temp table {table.name}_ids on commit drop
+            as select id from {table.schema}.{table.name} with no data;
+            """
+        )
+        searches[f"{table.name}_delta"] = _search(resource_type).filter(
+            qrange(
+                ElasticResourceAttribute.MODIFIED,
+                gte=int(modified_since.timestamp() * 1000),
+                format="epoch_millis",
+            )
         )
+        searches[f"{table.name}_ids"] = _search(resource_type).source(
+            [ElasticResourceAttribute.NODEREF_ID]
+        )
+        ids_only.add(f"{table.name}_ids")
+
+    ratios = _projected_ratios(
+        {target: s for target, s in searches.items() if target not in ids_only}
+    )
+
+    _, sizes = _copy_hits(
+        session,
+        searches=searches,
+        derived_at=derived_at,
+        slices=slices,
+        batch_size=batch_size,
+        ids_only=ids_only,
+        progress=progress,
     )
+    _log_savings(sizes, ratios)
+
+    counts = {}
+    for table in _RESOURCE_TYPES:
+        name = f"{table.schema}.{table.name}"
+        result = session.execute(
+            f"""
+            insert into {name} as r
+            select * from {table.name}_delta
+            on conflict (id) do update
+            set doc = excluded.doc, derived_at = excluded.derived_at
+            where r.doc::jsonb is distinct from excluded.doc::jsonb
+            """
+        )
+        counts[f"{name} changed"] = result.rowcount
 
-    seen = set()
-    for hit in s.scan():
-        if hit.nodeRef["id"] in seen:
-            continue
+        result = session.execute(
+            f"""
+            delete from {name} r
+            where not exists (select from {table.name}_ids i where i.id = r.id)
+            """
+        )
+        counts[f"{name} deleted"] = result.rowcount
+
+    return counts
+
+
+def _copy_hits(
+    session: Session,
+    searches: Dict[str, Search],
+    derived_at: datetime,
+    slices: int,
+    batch_size: int,
+    ids_only: Set[str] = frozenset(),
+    progress: Optional[Progress] = None,
+) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Scrolls the searches and copies the de-duplicated hits into the tables
+    they are keyed by, either as `(id, doc, derived_at)` or only `id` rows.
+
+    Returns the number of rows and of serialized document bytes per table.
+    """
+    progress = progress or Progress()
+    seen = {target: set() for target in searches}
+    batches: Dict[str, List[tuple]] = {target: [] for target in searches}
+    counts = {target: 0 for target in searches}
+    sizes = {target: 0 for target in searches}
+
+    def copy(target: str):
+        columns = ("id",) if target in ids_only else _COPY_COLUMNS
+        copied = _copy_batch(cursor, target, columns, batches[target])
+        counts[target] += copied
+        if target not in ids_only:
+            progress.add("documents_imported", copied)
+        batches[target].clear()
+
+    cursor = session.connection().connection.cursor()
+    try:
+        for target, hit in _scan_sliced(searches, slices=slices):
+            source = hit["_source"]
+            noderef_id = source["nodeRef"]["id"]
+            # slices are disjoint, but a resource may still be indexed twice
+            if noderef_id in seen[target]:
+                continue
+
+            seen[target].add(noderef_id)
+
+            batch = batches[target]
+            if target in ids_only:
+                batch.append((noderef_id,))
+            else:
+                doc = json.dumps(source)
+                sizes[target] += len(doc)
+                batch.append((noderef_id, doc, derived_at.isoformat()))
+            if len(batch) >= batch_size:
+                copy(target)
+
+        for target in batches:
+            copy(target)
+    finally:
+        cursor.close()
+
+    return counts, sizes
+
+
+def _projected_ratios(searches: Dict[str, Search]) -> Dict[str, float]:
+    if not ANALYTICS_IMPORT_PROJECTION:
+        return {}
 
-        seen.add(hit.nodeRef["id"])
+    ratios = {}
+    for target, s in searches.items():
+        try:
+            ratios[target] = projected_ratio(s)
+        except Exception as e:
+            logger.warning(f"Analytics: estimating projection for {target} failed: {e}")
+    return ratios
 
-        session.add(
-            Material(id=hit.nodeRef["id"], doc=hit.to_dict(), derived_at=derived_at)
+
+def _log_savings(sizes: Dict[str, int], ratios: Dict[str, float]):
+    for target, ratio in ratios.items():
+        log_savings(target, copied_bytes=sizes[target], ratio=ratio)
+
+
+def _scan_sliced(
+    searches: Dict[str, Search], slices: int
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Scrolls all searches with `slices` sliced scrolls each, every slice in its
+    own thread, and yields `(key, hit)` in the order hits arrive.
+    """
+    queue = Queue(maxsize=ANALYTICS_IMPORT_BATCH_SIZE)
+    stop = Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return
+            except Full:
+                continue
+
+    def scroll(key: str, s: Search):
+        try:
+            for hit in s.scan_raw():
+                if stop.is_set():
+                    return
+                put((key, hit))
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    threads = [
+        Thread(
+            target=scroll,
+            args=(
+                key,
+                (s.extra(slice={"id": i, "max": slices}) if slices > 1 else s),
+            ),
+            name=f"import-{key}-{i}",
+            daemon=True,
         )
+        for key, s in searches.items()
+        for i in range(max(slices, 1))
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        running = len(threads)
+        while running:
+            item = queue.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def _copy_batch(
+    cursor, target: str, columns: Tuple[str, ...], batch: List[tuple]
+) -> int:
+    if not batch:
+        return 0
+
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(batch)
+    buffer.seek(0)
+
+    cursor.copy_expert(
+        f"copy {target} ({', '.join(columns)}) from stdin with (format csv)", buffer
+    )
+    logger.debug(f"Analytics: copied {len(batch)} rows into {target}")
+
+    return len(batch)
@@ -1,48 +1,166 @@
-from functools import partial
+import asyncio
+from collections import deque
+from datetime import datetime
+from time import monotonic
+from typing import (
+    Deque,
+    Optional,
+)
 
-import httpx as http
-import polling2
 from jsonrpcclient import (
     Ok,
     request_uuid,
     parse,
 )
 
-from app.core.config import DBT_URL
+from app.analytics.jobs import Progress
+from app.core.config import (
+    DBT_POLL_INITIAL_INTERVAL,
+    DBT_POLL_MAX_INTERVAL,
+    DBT_RUN_DEADLINE,
+    DBT_URL,
+)
 from app.core.logging import logger
-
+from app.http import get_client
 
 _dbt_spellcheck_path = "models/spellcheck"
 
+# timings of the most recent dbt runs, newest last
+runs: Deque[dict] = deque(maxlen=50)
+
+
+class DbtError(Exception):
+    pass
 
-def run_analytics():
+
+class DbtTimeoutError(DbtError):
+    pass
+
+
+async def run_analytics(
+    deadline: float = DBT_RUN_DEADLINE, progress: Optional[Progress] = None
+) -> dict:
     cli_command = f"run --exclude path:{_dbt_spellcheck_path}"
-    return _send_rpc(method="cli_args", params={"cli": cli_command})
+    return await run(cli_command, deadline=deadline, progress=progress)
 
 
-def run_spellcheck():
+async def run_spellcheck(
+    deadline: float = DBT_RUN_DEADLINE, progress: Optional[Progress] = None
+) -> dict:
     cli_command = f"run --select path:{_dbt_spellcheck_path}"
-    return _send_rpc(method="cli_args", params={"cli": cli_command})
+    return await run(cli_command, deadline=deadline, progress=progress)
+
+
+async def run(
+    cli_command: str,
+    deadline: float = DBT_RUN_DEADLINE,
+    progress: Optional[Progress] = None,
+) -> dict:
+    """
+    Starts a dbt run and waits until it has finished, see `poll`.
+
+    The timings of the run are recorded in `runs` and as `dbt` in the progress
+    of the job, if given.
+    """
+    record = {
+        "command": cli_command,
+        "request_token": None,
+        "started_at": datetime.now(),
+        "state": "starting",
+        "duration": None,
+        "elapsed": None,
+        "polls": 0,
+    }
+    runs.append(record)
+    if progress is not None:
+        progress.set("dbt", record)
+    start = monotonic()
+
+    try:
+        result = await _send_rpc(method="cli_args", params={"cli": cli_command})
+        record["request_token"] = result["request_token"]
+        record["state"] = "running"
+        logger.info(f"dbt: run started {result}")
+
+        result = await poll(
+            request_token=result["request_token"], deadline=deadline, record=record
+        )
+        record["state"] = result.get("state")
+        record["elapsed"] = result.get("elapsed")
+        return result
+    except asyncio.CancelledError:
+        record["state"] = "cancelled"
+        raise
+    except Exception as e:
+        record["state"] = f"failed: {e}"
+        raise
+    finally:
+        record["duration"] = monotonic() - start
+        logger.info(
+            f"dbt: run {record['request_token']} {record['state']} after"
+            f" {record['duration']:.1f}s, {record['polls']} polls"
+        )
+
+
+async def poll(
+    request_token: str,
+    deadline: float = DBT_RUN_DEADLINE,
+    initial_interval: float = DBT_POLL_INITIAL_INTERVAL,
+    max_interval: float = DBT_POLL_MAX_INTERVAL,
+    record: Optional[dict] = None,
+) -> dict:
+    """
+    Polls the dbt task until it has succeeded, with exponentially growing
+    intervals starting at `initial_interval` and capped at `max_interval`.
+
+    Raises `DbtError` if the task has failed and `DbtTimeoutError` if it
+    has not finished within `deadline` seconds. The task is killed if it
+    times out or the polling is cancelled.
+    """
+    start = monotonic()
+    interval = initial_interval
+
+    try:
+        while True:
+            result = await _send_rpc(
+                method="poll", params={"request_token": request_token, "logs": False}
+            )
+            if record is not None:
+                record["polls"] += 1
+
+            state = result.get("state")
+            if state == "success":
+                return result
+            if state not in ("running", None):
+                raise DbtError(f"dbt task {request_token} ended with state {state}")
+
+            remaining = deadline - (monotonic() - start)
+            if remaining <= 0:
+                raise DbtTimeoutError(
+                    f"dbt task {request_token} did not finish within {deadline}s"
+                )
+
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, max_interval)
+    except (asyncio.CancelledError, DbtTimeoutError):
+        await asyncio.shield(kill(request_token))
+        raise
 
 
-def poll(request_token: str):
-    return polling2.poll(
-        partial(
-            _send_rpc,
-            method="poll",
-            params={"request_token": request_token, "logs": False},
-        ),
-        check_success=lambda result: result.get("state") == "success",
-        step=30,
-        max_tries=10,
-    )
+async def kill(request_token: str):
+    try:
+        await _send_rpc(method="kill", params={"task_id": request_token})
+        logger.info(f"dbt: killed task {request_token}")
+    except Exception as e:
+        logger.error(f"dbt: failed to kill task {request_token}: {e}")
 
 
-def _send_rpc(method: str, params: dict) -> dict:
-    response = http.post(DBT_URL, json=request_uuid(method, params=params))
+async def _send_rpc(method: str, params: dict) -> dict:
+    client = await get_client()
+    response = await client.post(DBT_URL, json=request_uuid(method, params=params))
     parsed = parse(response.json())
     if not isinstance(parsed, Ok):
         logger.error(f"Error from dbt server: {parsed.message}")
-        raise Exception(f"Error from dbt server: {parsed.message}")
+        raise DbtError(f"Error from dbt server: {parsed.message}")
 
     return parsed.result
@@ -0,0 +1,66 @@
+"""
+Local stand-in for the dbt RPC server, to run the analytics without a dbt
+container:
+
+    RPC_STANDIN_RUN_SECONDS=5 uvicorn app.analytics.rpc_standin:app --port 8580
+    DBT_URL=http://localhost:8580/jsonrpc
+
+Supports the `cli_args`, `poll` and `kill` methods used by `rpc_client`.
+Every task is reported as running for `RPC_STANDIN_RUN_SECONDS` seconds and
+succeeds afterwards, unless it has been killed.
+"""
+
+import os
+from time import monotonic
+from typing import Dict
+from uuid import uuid4
+
+from fastapi import (
+    Body,
+    FastAPI,
+)
+
+RUN_SECONDS = float(os.getenv("RPC_STANDIN_RUN_SECONDS", 2))
+
+app = FastAPI(title="dbt RPC stand-in")
+
+_tasks: Dict[str, dict] = {}
+
+
+def _cli_args(cli: str) -> dict:
+    request_token = str(uuid4())
+    _tasks[request_token] = {"cli": cli, "started": monotonic(), "state": "running"}
+    return {"request_token": request_token}
+
+
+def _poll(request_token: str, logs: bool = False) -> dict:
+    task = _tasks[request_token]
+    elapsed = monotonic() - task["started"]
+    if task["state"] == "running" and elapsed >= RUN_SECONDS:
+        task["state"] = "success"
+    return {"state": task["state"], "elapsed": round(elapsed, 3), "logs": []}
+
+
+def _kill(task_id: str) -> dict:
+    _tasks[task_id]["state"] = "killed"
+    return {"state": "killed"}
+
+
+_methods = {"cli_args": _cli_args, "poll": _poll, "kill": _kill}
+
+
+@app.post("/jsonrpc")
+async def jsonrpc(request: dict = Body(...)):
+    response = {"jsonrpc": "2.0", "id": request.get("id")}
+
+    method = _methods.get(request.get("method"))
+    if not method:
+        response["error"] = {"code": -32601, "message": "Method not found"}
+        return response
+
+    try:
+        response["result"] = method(**request.get("params", {}))
+    except (KeyError, TypeError) as e:
+        response["error"] = {"code": -32602, "message": f"Invalid params: {e}"}
+
+    return response
@@ -1,16 +1,39 @@
-from datetime import datetime
-from time import sleep
+import asyncio
+from datetime import (
+    datetime,
+    timedelta,
+)
+from typing import (
+    List,
+    Optional,
+)
 
 import sqlalchemy as sa
 import sqlalchemy.dialects.postgresql as sapg
 from fastapi_utils.tasks import repeat_every
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from app.analytics.jobs import (
+    Progress,
+    enqueue,
+    task,
+)
+from app.analytics.leases import leader_only
+from app.analytics.throttle import AdaptiveThrottle
 from app.core.config import (
+    BACKGROUND_TASK_SEARCH_STATS_BATCH_SIZE,
+    BACKGROUND_TASK_SEARCH_STATS_CONCURRENCY,
     BACKGROUND_TASK_SEARCH_STATS_INTERVAL,
+    BACKGROUND_TASK_SEARCH_STATS_REFRESH_INTERVAL,
     BACKGROUND_TASK_SEARCH_STATS_SLEEP_INTERVAL,
+    BACKGROUND_TASK_SEARCH_STATS_TARGET_LATENCY,
 )
 from app.core.logging import logger
-from app.crud.stats import search_hits_by_material_type
+from app.crud.stats import (
+    material_index_marker,
+    search_hits_by_material_types,
+)
 from app.pg.metadata import (
     Collection,
     ResourceField,
@@ -19,52 +42,205 @@ from app.pg.metadata import (
 )
 from app.pg.util import get_postgres
 
+throttle = AdaptiveThrottle(
+    "search_stats",
+    target_latency=BACKGROUND_TASK_SEARCH_STATS_TARGET_LATENCY,
+    max_concurrency=BACKGROUND_TASK_SEARCH_STATS_CONCURRENCY,
+    min_delay=BACKGROUND_TASK_SEARCH_STATS_SLEEP_INTERVAL,
+)
+
 
 @repeat_every(seconds=BACKGROUND_TASK_SEARCH_STATS_INTERVAL, logger=logger)
-def background_task():
-    run()
+@leader_only("search_stats", interval=BACKGROUND_TASK_SEARCH_STATS_INTERVAL)
+async def background_task():
+    await run_in_threadpool(enqueue, "search_stats")
 
 
-def run():
+@task("search_stats")
+async def run(
+    full: bool = False,
+    progress: Optional[Progress] = None,
+    batch_size: int = BACKGROUND_TASK_SEARCH_STATS_BATCH_SIZE,
+):
+    """
+    Computes the search stats of the collection titles which have changed,
+    see `_changed_titles`, or of all titles if `full` is given.
+
+    The titles are searched in `_msearch` batches of `batch_size`. The number
+    of batches in flight and the delay between them is adapted by `throttle`
+    to the latency and errors of elastic.
+    """
     now = datetime.now()
+    progress = progress or Progress()
     logger.info(f"Search stats: starting processing at: {now}")
 
+    marker = await material_index_marker()
+    rows = await run_in_threadpool(_changed_titles, now, marker, full)
+    batches = [rows[i : i + batch_size] for i in range(0, len(rows), batch_size)]
+    progress.set("titles", len(rows))
+
+    async def sweep(batch: List[sa.engine.Row]):
+        try:
+            async with throttle.slot(items=len(batch)) as observation:
+                titles = [row.title for row in batch]
+                stats = await search_hits_by_material_types(titles)
+                # failing searches of a batch are mostly rejected by a full queue
+                observation.overloaded = not all(stats)
+        except Exception as e:
+            # the titles are retried by the next sweep, see `_changed_titles`
+            logger.warning(f"Search stats: {len(batch)} searches failed: {e}")
+            progress.add("stats_failed", len(batch))
+            return
+
+        computed = [
+            (row, row_stats) for row, row_stats in zip(batch, stats) if row_stats
+        ]
+        if len(computed) < len(batch):
+            logger.warning(
+                f"Search stats: {len(batch) - len(computed)} searches failed"
+            )
+
+        await run_in_threadpool(_store, computed, now)
+        progress.add("stats_computed", len(computed))
+        progress.add("stats_failed", len(batch) - len(computed))
+
+    throttle.start_run()
+    sweeps = [asyncio.ensure_future(sweep(batch)) for batch in batches]
+    try:
+        await asyncio.gather(*sweeps)
+    finally:
+        # the other sweeps stop as well if one has failed
+        for pending in sweeps:
+            pending.cancel()
+        await asyncio.gather(*sweeps, return_exceptions=True)
+        throttle.finish_run()
+
+    logger.info(f"Search stats: processing finished at: {datetime.now()}")
+
+
+def _changed_titles(
+    derived_at: datetime, marker: str, full: bool = False
+) -> List[sa.engine.Row]:
+    """
+    Returns the collection titles whose stats are missing or outdated: the
+    normalized title differs from the stored search text, the materials in
+    the index have changed since the stats were derived (`marker`), or the
+    stats are older than `BACKGROUND_TASK_SEARCH_STATS_REFRESH_INTERVAL`.
+
+    Stats which failed in a previous sweep are outdated as well and retried.
+    """
     with next(get_postgres()) as session:
+        _create_table(session)
+        last_sweep = session.execute(
+            """
+            select marker, marker_since from store.search_stats_sweeps
+            order by derived_at desc
+            limit 1
+            """
+        ).one_or_none()
+        if last_sweep and last_sweep.marker == marker:
+            marker_since = last_sweep.marker_since
+        else:
+            marker_since = derived_at
+        refresh_before = derived_at - timedelta(
+            seconds=BACKGROUND_TASK_SEARCH_STATS_REFRESH_INTERVAL
+        )
+        outdated_before = max(marker_since, refresh_before)
+
+        collections = Collection.__table__
         c_title = sa.literal_column("doc -> 'properties' ->> 'cm:title'").label("title")
-        for i, row in enumerate(
-            session.execute(
-                sa.select(Collection.__table__.c.id, c_title).where(c_title.isnot(None))
-            )
-        ):
-            sleep(BACKGROUND_TASK_SEARCH_STATS_SLEEP_INTERVAL)
-            stats = search_hits_by_material_type(row.title)
-
-            stmt = sapg.insert(search_stats).values(
-                resource_id=row.id,
-                resource_field=ResourceField.TITLE,
-                resource_type=ResourceType.COLLECTION,
-                searchtext=row.title,
-                derived_at=now,
-                stats=stats,
-            )
-            session.execute(
-                stmt.on_conflict_do_update(
-                    index_elements=[
-                        search_stats.c.resource_id,
-                        search_stats.c.resource_field,
-                    ],
-                    set_=dict(
-                        searchtext=stmt.excluded.searchtext,
-                        derived_at=stmt.excluded.derived_at,
-                        stats=stmt.excluded.stats,
+        query = sa.select(collections.c.id, c_title).where(c_title.isnot(None))
+        if not full:
+            query = query.select_from(
+                collections.outerjoin(
+                    search_stats,
+                    sa.and_(
+                        search_stats.c.resource_id == collections.c.id,
+                        search_stats.c.resource_field == ResourceField.TITLE,
                     ),
                 )
+            ).where(
+                sa.or_(
+                    search_stats.c.resource_id.is_(None),
+                    search_stats.c.derived_at < outdated_before,
+                    _normalized(search_stats.c.searchtext) != _normalized(c_title),
+                )
             )
+        rows = list(session.execute(query))
+
+        session.execute(
+            sa.text(
+                """
+                insert into store.search_stats_sweeps
+                    (derived_at, marker, marker_since, full_sweep, titles)
+                values (:derived_at, :marker, :marker_since, :full_sweep, :titles)
+                """
+            ),
+            {
+                "derived_at": derived_at,
+                "marker": marker,
+                "marker_since": marker_since,
+                "full_sweep": full,
+                "titles": len(rows),
+            },
+        )
+        session.commit()
+
+    logger.info(
+        f"Search stats: {len(rows)} titles changed, materials unchanged since"
+        f" {marker_since} ({marker})"
+    )
+    return rows
 
-            if i > 0 and i % 100 == 0:
-                session.commit()
-                logger.info(f"Search stats: {i} stats completed")
 
+def _normalized(text: sa.sql.ColumnElement) -> sa.sql.ColumnElement:
+    """ Case and whitespace don't change the hits of a search text """
+    return sa.func.lower(sa.func.regexp_replace(sa.func.btrim(text), r"\s+", " ", "g"))
+
+
+def _store(computed: List[tuple], derived_at: datetime):
+    if not computed:
+        return
+
+    with next(get_postgres()) as session:
+        stmt = sapg.insert(search_stats).values(
+            [
+                dict(
+                    resource_id=row.id,
+                    resource_field=ResourceField.TITLE,
+                    resource_type=ResourceType.COLLECTION,
+                    searchtext=row.title,
+                    derived_at=derived_at,
+                    stats=stats,
+                )
+                for row, stats in computed
+            ]
+        )
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[
+                    search_stats.c.resource_id,
+                    search_stats.c.resource_field,
+                ],
+                set_=dict(
+                    searchtext=stmt.excluded.searchtext,
+                    derived_at=stmt.excluded.derived_at,
+                    stats=stmt.excluded.stats,
+                ),
+            )
+        )
         session.commit()
 
-    logger.info(f"Search stats: processing finished at: {datetime.now()}")
+
+def _create_table(session: Session):
+    session.execute(
+        """
+        create table if not exists store.search_stats_sweeps (
+            derived_at timestamp primary key,
+            marker text not null,
+            marker_since timestamp not null,
+            full_sweep boolean not null,
+            titles int not null
+        );
+        """
+    )
@@ -1,77 +1,162 @@
+import asyncio
 from datetime import datetime
+from time import monotonic
+from typing import (
+    AsyncIterator,
+    List,
+    Optional,
+    Tuple,
+)
 
 import sqlalchemy as sa
 import sqlalchemy.dialects.postgresql as sapg
 from fastapi_utils.tasks import repeat_every
-from pylanguagetool import api as languagetool
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 import app.analytics.rpc_client as dbt
+import app.crud.languagetool as crud_languagetool
+from app.analytics.jobs import (
+    Progress,
+    enqueue,
+    task,
+)
+from app.analytics.leases import leader_only
+from app.analytics.throttle import AdaptiveThrottle
 from app.core.config import (
+    BACKGROUND_TASK_SPELLCHECK_BATCH_SIZE,
+    BACKGROUND_TASK_SPELLCHECK_CONCURRENCY,
     BACKGROUND_TASK_SPELLCHECK_INTERVAL,
+    BACKGROUND_TASK_SPELLCHECK_TARGET_LATENCY,
+    BACKGROUND_TASK_SPELLCHECK_WORKERS,
     DEBUG,
-    LANGUAGETOOL_ENABLED_CATEGORIES,
-    LANGUAGETOOL_URL,
 )
 from app.core.logging import logger
+from app.http import get_client
 from app.pg.metadata import (
     spellcheck,
     spellcheck_queue,
 )
-from app.pg.util import get_postgres
+from app.pg.util import (
+    get_postgres,
+    get_postgres_async,
+)
+
+throttle = AdaptiveThrottle(
+    "spellcheck",
+    target_latency=BACKGROUND_TASK_SPELLCHECK_TARGET_LATENCY,
+    max_concurrency=BACKGROUND_TASK_SPELLCHECK_CONCURRENCY,
+)
 
 
 @repeat_every(seconds=BACKGROUND_TASK_SPELLCHECK_INTERVAL, logger=logger)
-def background_task():
-    run()
+@leader_only("spellcheck", interval=BACKGROUND_TASK_SPELLCHECK_INTERVAL)
+async def background_task():
+    await run_in_threadpool(enqueue, "spellcheck")
 
 
-def run():
-    logger.info(f"Spellcheck: starting processing at: {datetime.now()}")
+@task("spellcheck")
+async def run(
+    progress: Optional[Progress] = None,
+    batch_size: int = BACKGROUND_TASK_SPELLCHECK_BATCH_SIZE,
+    workers: int = BACKGROUND_TASK_SPELLCHECK_WORKERS,
+):
+    """
+    Checks the texts in the spellcheck queue with LanguageTool.
 
-    with next(get_postgres()) as session:
-        rows = list(session.execute(sa.select(spellcheck_queue)))
-
-        logger.debug(f"Spellcheck: {len(rows)} retrieved")
+    The queue is drained by `workers` consumers, which claim batches of
+    `batch_size` texts, see `_claimed_batches`, so consumers of this and other
+    workers never check the same texts. Texts with cached results, see
+    `crud.languagetool.get_cached_results`, are not checked again. The other
+    texts of a batch are checked concurrently, as many at once as `throttle`
+    allows, while the results of the previous batch are stored. Texts whose
+    check has failed remain in the queue.
+    """
+    progress = progress or Progress()
+    logger.info(f"Spellcheck: starting processing at: {datetime.now()}")
 
-        for i, row in enumerate(rows):
-            response = _spellcheck(row.text_content)
+    http = await get_client()
+    pool = await get_postgres_async()
 
-            if "matches" in response and response["matches"]:
+    async def check(row: sa.engine.Row) -> Optional[dict]:
+        try:
+            async with throttle.slot():
+                return await crud_languagetool.check_text(http, text=row.text_content)
+        except Exception as e:
+            logger.warning(f"Spellcheck: check of {row.resource_id} failed: {e}")
+            return None
 
-                if DEBUG:
-                    logger.debug(f"Spellcheck: found error for row: {row}")
+    start = monotonic()
+    checked = 0
 
-                t = spellcheck
-                stmt = sapg.insert(t).values(
-                    resource_id=row.resource_id,
-                    resource_type=row.resource_type,
-                    resource_field=row.resource_field,
-                    text_content=row.text_content,
-                    derived_at=row.derived_at,
-                    error=response,
-                )
-                session.execute(
-                    stmt.on_conflict_do_update(
-                        index_elements=[t.c.resource_id, t.c.resource_field],
-                        set_=dict(
-                            text_content=stmt.excluded.text_content,
-                            derived_at=stmt.excluded.derived_at,
-                            error=stmt.excluded.error,
-                        ),
+    async def consume():
+        nonlocal checked
+        storing = None
+        try:
+            async for session, batch in _claimed_batches(batch_size):
+                handed_over = False
+                try:
+                    responses = await check_batch(batch)
+                    # the previous batch is stored even if this consumer is cancelled
+                    if storing:
+                        await asyncio.shield(storing)
+                    # `_store` closes the session
+                    storing = asyncio.ensure_future(
+                        run_in_threadpool(_store, session, list(zip(batch, responses)))
                     )
+                    handed_over = True
+                finally:
+                    if not handed_over:
+                        # releases the claimed texts, blocking as we may be cancelled
+                        session.close()
+
+                succeeded = sum(response is not None for response in responses)
+                checked += succeeded
+                texts_per_second = checked / (monotonic() - start)
+                progress.add("texts_checked", succeeded)
+                progress.add("texts_failed", len(batch) - succeeded)
+                progress.set("texts_per_second", texts_per_second)
+                logger.info(
+                    f"Spellcheck: {checked} texts checked, {texts_per_second:.1f}/s"
                 )
+        finally:
+            if storing:
+                await asyncio.shield(storing)
 
-            session.execute(
-                sa.delete(spellcheck_queue)
-                .where(spellcheck_queue.c.resource_id == row.resource_id)
-                .where(spellcheck_queue.c.resource_field == row.resource_field)
-            )
+    async def check_batch(batch: List[sa.engine.Row]) -> List[Optional[dict]]:
+        keys = [crud_languagetool.text_hash(row.text_content) for row in batch]
+        cached = await crud_languagetool.get_cached_results(pool, keys)
+        progress.add("texts_cached", sum(key in cached for key in keys))
 
-            if i > 0 and i % 100 == 0:
-                session.commit()
-                logger.info(f"Spellcheck: {i} spellchecks completed")
+        # texts occurring several times in a batch are checked once
+        misses = {key: row for row, key in zip(batch, keys) if key not in cached}
+        checks = await asyncio.gather(*(check(row) for row in misses.values()))
+        results = {
+            key: response
+            for key, response in zip(misses, checks)
+            if response is not None
+        }
+        await crud_languagetool.cache_results(pool, results)
 
-        session.commit()
+        # LanguageTool is most likely down
+        if not cached and not results:
+            raise SpellcheckError(f"all {len(batch)} checks of a batch failed")
+
+        return [cached.get(key) or results.get(key) for key in keys]
+
+    throttle.start_run()
+    consumers = [asyncio.ensure_future(consume()) for _ in range(max(workers, 1))]
+    try:
+        await asyncio.gather(*consumers)
+    finally:
+        # the other consumers stop as well if one has failed
+        for consumer in consumers:
+            consumer.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        throttle.finish_run()
+
+    purged = await crud_languagetool.purge_cache(pool)
+    logger.info(f"Spellcheck: purged {purged} expired LanguageTool results")
 
     logger.info(f"Spellcheck: processing finished at: {datetime.now()}")
 
@@ -79,13 +164,114 @@ def run():
     # logger.info(f"Analytics: spellcheck run started {result}")
 
 
-def _spellcheck(text, lang="de-DE"):
-    response = languagetool.check(
-        text,
-        api_url=f"{LANGUAGETOOL_URL}/",
-        lang=lang,
-        enabled_categories=",".join(LANGUAGETOOL_ENABLED_CATEGORIES),
-        enabled_only=True,
+class SpellcheckError(Exception):
+    pass
+
+
+async def _claimed_batches(
+    batch_size: int,
+) -> AsyncIterator[Tuple[Session, List[sa.engine.Row]]]:
+    """
+    Claims the spellcheck queue in batches, ordered by its primary key.
+
+    The texts of a batch are locked by the transaction of the yielded session
+    until it is committed by `_store` or closed. Texts locked by other
+    consumers are skipped, and texts which remain in the queue after their
+    check has failed are not claimed again by this consumer.
+    """
+    after = None
+    while True:
+        claim = asyncio.ensure_future(
+            run_in_threadpool(_claim_batch, after, batch_size)
+        )
+        try:
+            session, batch = await asyncio.shield(claim)
+        except asyncio.CancelledError:
+            # the claim completes in its thread regardless, and is released
+            session, _ = await claim
+            session.close()
+            raise
+        if not batch:
+            return
+
+        yield session, batch
+        after = (batch[-1].resource_id, batch[-1].resource_field)
+
+
+def _claim_batch(
+    after: Optional[tuple], batch_size: int
+) -> Tuple[Session, List[sa.engine.Row]]:
+    t = spellcheck_queue
+    query = (
+        sa.select(t)
+        .order_by(t.c.resource_id, t.c.resource_field)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
     )
+    if after:
+        query = query.where(sa.tuple_(t.c.resource_id, t.c.resource_field) > after)
+
+    session = next(get_postgres())
+    try:
+        batch = list(session.execute(query))
+    except Exception:
+        session.close()
+        raise
+    if not batch:
+        session.close()
+
+    return session, batch
+
+
+def _store(session: Session, results: List[Tuple[sa.engine.Row, Optional[dict]]]):
+    """
+    Stores the texts with errors and removes the checked texts from the queue,
+    in the transaction which has claimed them.
+    """
+    with session:
+        checked = [(row, response) for row, response in results if response is not None]
+        errors = [
+            (row, response) for row, response in checked if response.get("matches")
+        ]
+
+        if errors:
+            if DEBUG:
+                for row, _ in errors:
+                    logger.debug(f"Spellcheck: found error for row: {row}")
+
+            t = spellcheck
+            stmt = sapg.insert(t).values(
+                [
+                    dict(
+                        resource_id=row.resource_id,
+                        resource_type=row.resource_type,
+                        resource_field=row.resource_field,
+                        text_content=row.text_content,
+                        derived_at=row.derived_at,
+                        error=response,
+                    )
+                    for row, response in errors
+                ]
+            )
+            session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[t.c.resource_id, t.c.resource_field],
+                    set_=dict(
+                        text_content=stmt.excluded.text_content,
+                        derived_at=stmt.excluded.derived_at,
+                        error=stmt.excluded.error,
+                    ),
+                )
+            )
+
+        if checked:
+            t = spellcheck_queue
+            session.execute(
+                sa.delete(t).where(
+                    sa.tuple_(t.c.resource_id, t.c.resource_field).in_(
+                        [(row.resource_id, row.resource_field) for row, _ in checked]
+                    )
+                )
+            )
 
-    return response
+        session.commit()
@@ -0,0 +1,210 @@
+"""md
+# Adaptive throttle
+
+Rate control of the background sweeps against elastic and LanguageTool,
+based on additive increase / multiplicative decrease (AIMD):
+
+- every request finishing within `target_latency` adds `1 / concurrency` to
+  the concurrency, i.e. one more request in flight per round-trip, and
+  halves the delay between requests
+- a request above the target latency or failing with an overload error
+  (429, 502-504, timeouts) halves the concurrency and doubles the delay,
+  at most once per round-trip
+
+The current settings and the throughput of every throttle are available via
+`stats()`.
+"""
+
+import asyncio
+from contextlib import (
+    asynccontextmanager,
+    contextmanager,
+)
+from threading import Lock
+from time import monotonic
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterator,
+    Optional,
+)
+
+import httpx
+from elasticsearch.exceptions import ConnectionError as ElasticConnectionError
+
+OVERLOAD_STATUS_CODES = (429, 502, 503, 504, "TIMEOUT")
+
+throttles: Dict[str, "AdaptiveThrottle"] = {}
+
+
+class Observation:
+    """ Outcome of a throttled request, may be marked as overloaded by the caller """
+
+    def __init__(self):
+        self.overloaded = False
+
+
+class AdaptiveThrottle:
+    def __init__(
+        self,
+        name: str,
+        target_latency: float,
+        max_concurrency: int = 1,
+        min_delay: float = 0,
+        max_delay: float = 30,
+    ):
+        self.name = name
+        self.target_latency = target_latency
+        self.max_concurrency = max(max_concurrency, 1)
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+        self.concurrency = 1.0
+        self.delay = min_delay
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+
+        self.requests = 0
+        self.overloads = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._run_started = monotonic()
+        self._run_items = 0
+        self._run_finished: Optional[float] = self._run_started
+
+        self._lock = Lock()
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        throttles[name] = self
+
+    @property
+    def limit(self) -> int:
+        return int(self.concurrency)
+
+    def start_run(self):
+        """ Resets the throughput, but keeps the settings of the previous run """
+        with self._lock:
+            self._run_started = monotonic()
+            self._run_items = 0
+            self._run_finished = None
+
+    def finish_run(self):
+        with self._lock:
+            self._run_finished = monotonic()
+
+    def record(self, latency: float, overloaded: bool = False, items: int = 1):
+        with self._lock:
+            self.requests += 1
+            self._run_items += items
+            self.latency = (
+                latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            )
+
+            if overloaded or latency > self.target_latency:
+                self.overloads += overloaded
+                # requests in flight during a decrease don't decrease again
+                now = monotonic()
+                if now - self._last_decrease > self.latency:
+                    self._last_decrease = now
+                    self.decreases += 1
+                    self.concurrency = max(self.concurrency / 2, 1.0)
+                    self.delay = min(max(self.delay * 2, 0.1), self.max_delay)
+            else:
+                self.concurrency = min(
+                    self.concurrency + 1 / self.concurrency, self.max_concurrency
+                )
+                self.delay = max(self.delay / 2, self.min_delay)
+                if self.delay < 0.01:
+                    self.delay = self.min_delay
+
+    @contextmanager
+    def observe(self, items: int = 1) -> Iterator[Observation]:
+        """ Records the latency and outcome of the request in the block """
+        observation = Observation()
+        start = monotonic()
+        try:
+            yield observation
+        except Exception as e:
+            observation.overloaded = observation.overloaded or is_overload(e)
+            raise
+        finally:
+            self.record(
+                monotonic() - start, overloaded=observation.overloaded, items=items
+            )
+
+    @asynccontextmanager
+    async def slot(self, items: int = 1) -> AsyncIterator[Observation]:
+        """
+        Waits until less than `limit` requests are in flight, observes the
+        request in the block and holds the slot for `delay` afterwards.
+        """
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+        try:
+            with self.observe(items=items) as observation:
+                yield observation
+
+            if self.delay:
+                await asyncio.sleep(self.delay)
+        finally:
+            async with condition:
+                self.in_flight -= 1
+                condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            end = self._run_finished or monotonic()
+            elapsed = end - self._run_started
+            return {
+                "name": self.name,
+                "concurrency": self.limit,
+                "max_concurrency": self.max_concurrency,
+                "delay": self.delay,
+                "in_flight": self.in_flight,
+                "target_latency": self.target_latency,
+                "latency": self.latency,
+                "requests": self.requests,
+                "overloads": self.overloads,
+                "decreases": self.decreases,
+                "running": self._run_finished is None,
+                "items": self._run_items,
+                "items_per_second": self._run_items / elapsed if elapsed else None,
+            }
+
+    def _get_condition(self) -> asyncio.Condition:
+        # conditions are bound to the loop they are first used in
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+        return self._condition
+
+
+def is_overload(e: Exception) -> bool:
+    """ Whether the error indicates an overloaded elastic or LanguageTool """
+    response = getattr(e, "response", None)
+    status_code = getattr(e, "status_code", None) or getattr(
+        response, "status_code", None
+    )
+    if status_code not in (None, "N/A"):
+        return status_code in OVERLOAD_STATUS_CODES
+
+    # e.g. connection errors of elastic, httpx and requests (an OSError)
+    return isinstance(
+        e,
+        (
+            ElasticConnectionError,
+            httpx.TimeoutException,
+            httpx.NetworkError,
+            asyncio.TimeoutError,
+            OSError,
+        ),
+    )
+
+
+def stats() -> list:
+    return [throttle.stats() for throttle in throttles.values()]
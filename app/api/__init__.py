@@ -3,7 +3,11 @@ from importlib import import_module
 from app.core.config import API_VERSION
 
 from .util import (
+    CursorPaginationParams,
+    cursor_pagination_params,
     materials_filter_params,
+    ndjson_requested,
+    ndjson_response,
     PaginationParams,
     pagination_params,
 )
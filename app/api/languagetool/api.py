@@ -104,7 +104,7 @@ class CheckTextBody(BaseModel):
     },
 )
 async def check_text(*, body: CheckTextBody, http: AsyncClient = Depends(get_client)):
-    response = await crud_languagetool.check_text(http, **body.dict())
+    response = await crud_languagetool.check_text_cached(http, **body.dict())
 
     return JSONResponse(content=response)
 
@@ -1,19 +1,33 @@
+import json
 from typing import (
+    AsyncIterator,
     List,
     Optional,
     Set,
+    Type,
 )
 from uuid import UUID
 
 from fastapi import (
+    Header,
     Path,
     Query,
 )
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from starlette.responses import Response
+from starlette.exceptions import HTTPException
+from starlette.responses import (
+    Response,
+    StreamingResponse,
+)
+from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 
 import app.crud.collection as crud_collection
-from app.core.config import PORTAL_ROOT_ID
+from app.core.config import (
+    ELASTIC_MAX_SIZE,
+    ELASTIC_PAGE_SIZE,
+    PORTAL_ROOT_ID,
+)
 from app.elastic.fields import Field
 from app.models.collection import CollectionAttribute
 from app.models.learning_material import LearningMaterialAttribute
@@ -23,6 +37,8 @@ from app.crud import (
     MissingCollectionAttributeFilter,
     MissingMaterialAttributeFilter,
 )
+from app.crud.util import Page
+from app.elastic.utils import decode_cursor
 
 
 def portal_id_param(
@@ -78,6 +94,34 @@ def filter_response_fields(
     return items
 
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def ndjson_requested(*, accept: str = Header(None)) -> bool:
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
+
+
+def ndjson_response(
+    records: AsyncIterator[dict],
+    model: Type[BaseModel],
+    response_fields: Set[Field] = None,
+) -> StreamingResponse:
+    """
+    Streams the records as NDJSON, each validated and serialized by `model`
+    like the items of the JSON response, i.e. excluding unset fields.
+    """
+    include = {f.name.lower() for f in response_fields} if response_fields else None
+
+    async def lines():
+        async for record in records:
+            item = jsonable_encoder(
+                model.parse_obj(record), include=include, exclude_unset=True
+            )
+            yield json.dumps(item) + "\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+
 def collections_filter_params(
     *, missing_attr: MissingCollectionField = Path(...)
 ) -> MissingCollectionAttributeFilter:
@@ -112,3 +156,41 @@ class PaginationParams(BaseModel):
     def __call__(self, records: list):
         self.response.headers["X-Total-Count"] = str(len(records))
         return records[self.start : self.stop]
+
+
+class CursorPaginationParams(BaseModel):
+    cursor: Optional[str] = None
+    size: int = ELASTIC_PAGE_SIZE
+    response: Response
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __call__(self, page: Page):
+        if page.total is not None:
+            self.response.headers["X-Total-Count"] = str(page.total)
+        if page.cursor:
+            self.response.headers["X-Next-Cursor"] = page.cursor
+        return page.items
+
+
+def cursor_pagination_params(
+    *,
+    _cursor: str = Query(None),
+    _size: int = Query(None, ge=1, le=ELASTIC_MAX_SIZE),
+    response: Response,
+) -> Optional[CursorPaginationParams]:
+    if _cursor is None and _size is None:
+        return None
+
+    if _cursor is not None:
+        try:
+            decode_cursor(_cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid cursor",
+            )
+
+    return CursorPaginationParams(
+        cursor=_cursor, size=_size or ELASTIC_PAGE_SIZE, response=response
+    )
@@ -1,11 +1,19 @@
+import os
+from typing import List
+
 from asyncpg import Pool
 from fastapi import (
     APIRouter,
     Depends,
+    Query,
     Security,
 )
 
+import app.analytics.rpc_client as dbt
+import app.analytics.throttle as throttle
 from app.api.auth import authenticated
+from app.cache import invalidate
+from app.elastic.coalescing import elastic_queries
 from app.pg.util import (
     get_postgres_async,
     close_postgres_connection,
@@ -28,6 +36,54 @@ async def pg_version(pool: Pool = Depends(get_postgres_async),):
         return {"version": version}
 
 
+@router.get(
+    "/elastic-coalescing",
+    response_model=dict,
+    dependencies=[Security(authenticated)],
+    tags=["Healthcheck", "Authenticated"],
+)
+async def elastic_coalescing():
+    """ Coalescing metrics of identical concurrent elastic queries in this worker """
+    return {"pid": os.getpid(), **elastic_queries.stats()}
+
+
+@router.get(
+    "/throttles",
+    response_model=dict,
+    dependencies=[Security(authenticated)],
+    tags=["Healthcheck", "Authenticated"],
+)
+async def throttles():
+    """ Adaptive throttles of the background sweeps in this worker """
+    return {"pid": os.getpid(), "throttles": throttle.stats()}
+
+
+@router.get(
+    "/dbt-runs",
+    response_model=dict,
+    dependencies=[Security(authenticated)],
+    tags=["Healthcheck", "Authenticated"],
+)
+async def dbt_runs():
+    """ Timings of the most recent dbt runs started by this worker, newest last """
+    return {"pid": os.getpid(), "runs": list(dbt.runs)}
+
+
+@router.delete(
+    "/cache",
+    response_model=dict,
+    dependencies=[Security(authenticated)],
+    tags=["Cache", "Authenticated"],
+)
+async def invalidate_cache(
+    *,
+    namespace: List[str] = Query(
+        None, description="e.g. stats.run_stats_scores, all entries if omitted"
+    ),
+):
+    return {"deleted": await invalidate(*(namespace or []))}
+
+
 router.include_router(analytics_router)
 router.include_router(background_tasks_router)
 
@@ -1,43 +1,142 @@
+from typing import (
+    List,
+    Optional,
+)
+
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
+    Query,
     Security,
 )
 from starlette.status import HTTP_202_ACCEPTED
 
-import app.analytics.analytics as analytics
-import app.analytics.search_stats as search_stats
-import app.analytics.spellcheck as spellcheck
+import app.analytics.jobs as jobs
+import app.analytics.leases as leases
 from app.api.auth import authenticated
+from app.crud.util import JobNotFoundException
 
 router = APIRouter()
 
 
 @router.post(
     "/run-analytics",
+    response_model=dict,
     dependencies=[Security(authenticated)],
     status_code=HTTP_202_ACCEPTED,
     tags=["Background Tasks", "Authenticated"],
 )
-async def run_analytics(*, background_tasks: BackgroundTasks):
-    background_tasks.add_task(analytics.run)
+def run_analytics(
+    *,
+    full: Optional[bool] = Query(
+        None, description="Full or delta import, depending on the last imports if omitted"
+    ),
+):
+    return _enqueue("analytics", full=full)
 
 
 @router.post(
     "/run-spellcheck",
+    response_model=dict,
     dependencies=[Security(authenticated)],
     status_code=HTTP_202_ACCEPTED,
     tags=["Background Tasks", "Authenticated"],
 )
-async def run_spellcheck(*, background_tasks: BackgroundTasks):
-    background_tasks.add_task(spellcheck.run)
+def run_spellcheck():
+    return _enqueue("spellcheck")
 
 
 @router.post(
     "/run-search-stats",
+    response_model=dict,
     dependencies=[Security(authenticated)],
     status_code=HTTP_202_ACCEPTED,
     tags=["Background Tasks", "Authenticated"],
 )
-async def run_search_stats(*, background_tasks: BackgroundTasks):
-    background_tasks.add_task(search_stats.run)
+def run_search_stats(
+    *,
+    full: bool = Query(
+        False, description="All collection titles, otherwise only changed ones"
+    ),
+):
+    return _enqueue("search_stats", full=full)
+
+
+@router.post(
+    "/run-pipeline",
+    response_model=dict,
+    dependencies=[Security(authenticated)],
+    status_code=HTTP_202_ACCEPTED,
+    tags=["Background Tasks", "Authenticated"],
+)
+def run_pipeline(
+    *,
+    full: Optional[bool] = Query(
+        None, description="Full or delta import, depending on the last imports if omitted"
+    ),
+    force: bool = Query(
+        False, description="Run stages even if their inputs are unchanged"
+    ),
+):
+    return _enqueue("pipeline", full=full, force=force)
+
+
+def _enqueue(task: str, **params) -> dict:
+    """ Queues the task, unless it is queued or running already """
+    job, created = jobs.enqueue(task, **params)
+    return {**job, "created": created}
+
+
+@router.get(
+    "/jobs",
+    response_model=List[dict],
+    dependencies=[Security(authenticated)],
+    tags=["Background Tasks", "Authenticated"],
+)
+def get_jobs(
+    *,
+    task: Optional[str] = Query(
+        None, description="analytics, search_stats or spellcheck"
+    ),
+    state: Optional[str] = Query(
+        None, description="queued, running, succeeded or failed"
+    ),
+    limit: int = Query(50, gt=0, le=1000),
+):
+    """ History of the jobs, most recently queued first """
+    return jobs.get_jobs(name=task, state=state, limit=limit)
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=dict,
+    dependencies=[Security(authenticated)],
+    tags=["Background Tasks", "Authenticated"],
+)
+def get_job(*, job_id: int):
+    """ State and progress counters of the job """
+    job = jobs.get_job(job_id)
+    if not job:
+        raise JobNotFoundException(job_id)
+    return job
+
+
+@router.get(
+    "/background-tasks",
+    response_model=List[dict],
+    dependencies=[Security(authenticated)],
+    tags=["Background Tasks", "Authenticated"],
+)
+def background_task_leases():
+    """ Last start of the periodic background tasks and the workers running them """
+    running = jobs.get_jobs(state="running")
+    return [
+        {
+            **task,
+            "running": [
+                {"job_id": job["id"], "worker": job["worker"]}
+                for job in running
+                if job["task"] == task["name"]
+            ],
+        }
+        for task in leases.holders()
+    ]
@@ -15,20 +15,25 @@ from starlette.status import (
     HTTP_200_OK,
     HTTP_404_NOT_FOUND,
 )
-from starlette_context import context
 
 import app.crud.collection as crud_collection
 import app.crud.stats as crud_stats
 from app.api.util import (
+    CursorPaginationParams,
     collections_filter_params,
     collection_response_fields,
+    cursor_pagination_params,
     filter_response_fields,
+    NDJSON_MEDIA_TYPE,
+    ndjson_requested,
+    ndjson_response,
     portal_id_param,
     portal_id_with_root_param,
 )
 from app.crud import MissingCollectionAttributeFilter
 from app.crud.elastic import ResourceType
 from app.crud.util import build_portal_tree
+from app.elastic.tracing import query_count
 from app.models.collection import (
     Collection,
     CollectionAttribute,
@@ -56,16 +61,36 @@ async def get_portals():
     "/collections/{noderef_id}/tree",
     response_model=List[PortalTreeNode],
     status_code=HTTP_200_OK,
-    responses={HTTP_404_NOT_FOUND: {"description": "Collection not found"}},
+    responses={
+        HTTP_200_OK: {
+            "content": {NDJSON_MEDIA_TYPE: {}},
+            "description": f"With `Accept: {NDJSON_MEDIA_TYPE}` the flat list of collections sorted by path is streamed instead of the tree.",
+        },
+        HTTP_404_NOT_FOUND: {"description": "Collection not found"},
+    },
     tags=["Collections"],
 )
 async def get_portal_tree(
-    *, noderef_id: UUID = Depends(portal_id_with_root_param), response: Response,
+    *,
+    noderef_id: UUID = Depends(portal_id_with_root_param),
+    ndjson: bool = Depends(ndjson_requested),
+    response: Response,
 ):
+    if ndjson:
+        return ndjson_response(
+            crud_collection.stream_many_sorted(root_noderef_id=noderef_id),
+            Collection,
+            response_fields={
+                CollectionAttribute.NODEREF_ID,
+                CollectionAttribute.TITLE,
+                CollectionAttribute.PARENT_ID,
+            },
+        )
+
     collections = await crud_collection.get_many_sorted(root_noderef_id=noderef_id)
     tree = await build_portal_tree(collections=collections, root_noderef_id=noderef_id)
     response.headers["X-Total-Count"] = str(len(collections))
-    response.headers["X-Query-Count"] = str(len(context.get("elastic_queries")))
+    response.headers["X-Query-Count"] = str(query_count())
     return tree
 
 
@@ -74,7 +99,10 @@ async def get_portal_tree(
     response_model=List[Collection],
     response_model_exclude_unset=True,
     status_code=HTTP_200_OK,
-    responses={HTTP_404_NOT_FOUND: {"description": "Collection not found"}},
+    responses={
+        HTTP_200_OK: {"content": {NDJSON_MEDIA_TYPE: {}}},
+        HTTP_404_NOT_FOUND: {"description": "Collection not found"},
+    },
     tags=["Collections"],
 )
 async def filter_collections_with_missing_attributes(
@@ -86,19 +114,42 @@ async def filter_collections_with_missing_attributes(
     response_fields: Optional[Set[CollectionAttribute]] = Depends(
         collection_response_fields
     ),
+    pagination: Optional[CursorPaginationParams] = Depends(cursor_pagination_params),
+    ndjson: bool = Depends(ndjson_requested),
     response: Response,
 ):
     if response_fields:
         response_fields.add(CollectionAttribute.NODEREF_ID)
 
-    collections = await crud_collection.get_child_collections_with_missing_attributes(
-        noderef_id=noderef_id,
-        missing_attr_filter=missing_attr_filter,
-        source_fields=response_fields,
-    )
+    if ndjson:
+        return ndjson_response(
+            crud_collection.stream_many(
+                ancestor_id=noderef_id,
+                missing_attr_filter=missing_attr_filter,
+                source_fields=response_fields,
+            ),
+            Collection,
+            response_fields=response_fields,
+        )
 
-    response.headers["X-Total-Count"] = str(len(collections))
-    response.headers["X-Query-Count"] = str(len(context.get("elastic_queries")))
+    if pagination:
+        page = await crud_collection.get_page(
+            ancestor_id=noderef_id,
+            missing_attr_filter=missing_attr_filter,
+            source_fields=response_fields,
+            size=pagination.size,
+            cursor=pagination.cursor,
+        )
+        collections = pagination(page)
+    else:
+        collections = await crud_collection.get_child_collections_with_missing_attributes(
+            noderef_id=noderef_id,
+            missing_attr_filter=missing_attr_filter,
+            source_fields=response_fields,
+        )
+        response.headers["X-Total-Count"] = str(len(collections))
+
+    response.headers["X-Query-Count"] = str(query_count())
     return filter_response_fields(collections, response_fields=response_fields)
 
 
@@ -111,9 +162,9 @@ async def filter_collections_with_missing_attributes(
 async def search_hits_by_material_type(
     *, query_str: str = Query(..., min_length=3, max_length=50), response: Response
 ):
-    search_stats = crud_stats.search_hits_by_material_type(query_str)
+    search_stats = await crud_stats.search_hits_by_material_type(query_str)
 
-    response.headers["X-Query-Count"] = str(len(context.get("elastic_queries")))
+    response.headers["X-Query-Count"] = str(query_count())
     return search_stats
 
 
@@ -131,7 +182,7 @@ async def material_counts_by_type(
     )
 
     response.headers["X-Total-Count"] = str(len(material_counts))
-    response.headers["X-Query-Count"] = str(len(context.get("elastic_queries")))
+    response.headers["X-Query-Count"] = str(query_count())
     return material_counts
 
 
@@ -145,7 +196,10 @@ async def material_counts_by_type(
 async def material_counts_tree(
     *, noderef_id: UUID = Depends(portal_id_with_root_param), response: Response,
 ):
-    descendant_collections = await crud_collection.get_many(
+    (
+        descendant_collections,
+        materials_counts,
+    ) = await crud_collection.get_many_with_material_counts(
         ancestor_id=noderef_id,
         source_fields={
             CollectionAttribute.NODEREF_ID,
@@ -153,9 +207,6 @@ async def material_counts_tree(
             CollectionAttribute.TITLE,
         },
     )
-    materials_counts = await crud_collection.material_counts_by_descendant(
-        ancestor_id=noderef_id,
-    )
 
     descendant_collections = {
         collection.noderef_id: collection.title for collection in descendant_collections
@@ -188,7 +239,7 @@ async def material_counts_tree(
     ]
 
     response.headers["X-Total-Count"] = str(len(stats))
-    response.headers["X-Query-Count"] = str(len(context.get("elastic_queries")))
+    response.headers["X-Query-Count"] = str(query_count())
     # response.headers["X-Total-Errors"] = str(len(errors))
     return stats
 
@@ -224,18 +275,14 @@ async def score(
     if not score_weights:
         score_weights = ScoreWeights.UNIFORM
 
-    collection_stats = await crud_stats.run_stats_score(
-        noderef_id=noderef_id, resource_type=ResourceType.COLLECTION
+    collection_stats, material_stats = await crud_stats.run_stats_scores(
+        noderef_id=noderef_id,
+        resource_types=[ResourceType.COLLECTION, ResourceType.MATERIAL],
     )
 
     collection_scores = calc_scores(
         stats=collection_stats, score_modulator=score_modulator
     )
-
-    material_stats = await crud_stats.run_stats_score(
-        noderef_id=noderef_id, resource_type=ResourceType.MATERIAL
-    )
-
     material_scores = calc_scores(stats=material_stats, score_modulator=score_modulator)
 
     score_ = calc_weighted_score(
@@ -244,7 +291,7 @@ async def score(
         score_weights=score_weights,
     )
 
-    response.headers["X-Query-Count"] = str(len(context.get("elastic_queries", [])))
+    response.headers["X-Query-Count"] = str(query_count())
     return {
         "score": score_,
         "collections": {"total": collection_stats["total"], **collection_scores},
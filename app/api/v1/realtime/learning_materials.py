@@ -14,17 +14,22 @@ from starlette.status import (
     HTTP_200_OK,
     HTTP_404_NOT_FOUND,
 )
-from starlette_context import context
 
 import app.crud.collection as crud_collection
 import app.crud.learning_material as crud_materials
 from app.api.util import (
+    CursorPaginationParams,
+    cursor_pagination_params,
     filter_response_fields,
     materials_filter_params,
     material_response_fields,
+    NDJSON_MEDIA_TYPE,
+    ndjson_requested,
+    ndjson_response,
     portal_id_with_root_param,
 )
 from app.crud import MissingMaterialAttributeFilter
+from app.elastic.tracing import query_count
 from app.models.learning_material import (
     LearningMaterial,
     LearningMaterialAttribute,
@@ -42,7 +47,7 @@ router = APIRouter()
 async def get_material_types(response: Response):
     material_types = await crud_materials.material_types()
 
-    response.headers["X-Query-Count"] = str(len(context.get("elastic_queries")))
+    response.headers["X-Query-Count"] = str(query_count())
     return material_types
 
 
@@ -51,7 +56,10 @@ async def get_material_types(response: Response):
     response_model=List[LearningMaterial],
     response_model_exclude_unset=True,
     status_code=HTTP_200_OK,
-    responses={HTTP_404_NOT_FOUND: {"description": "Collection not found"}},
+    responses={
+        HTTP_200_OK: {"content": {NDJSON_MEDIA_TYPE: {}}},
+        HTTP_404_NOT_FOUND: {"description": "Collection not found"},
+    },
     tags=["Materials"],
 )
 async def filter_materials_with_missing_attributes(
@@ -63,17 +71,40 @@ async def filter_materials_with_missing_attributes(
     response_fields: Optional[Set[LearningMaterialAttribute]] = Depends(
         material_response_fields
     ),
+    pagination: Optional[CursorPaginationParams] = Depends(cursor_pagination_params),
+    ndjson: bool = Depends(ndjson_requested),
     response: Response,
 ):
     if response_fields:
         response_fields.add(LearningMaterialAttribute.NODEREF_ID)
 
-    materials = await crud_collection.get_child_materials_with_missing_attributes(
-        noderef_id=noderef_id,
-        missing_attr_filter=missing_attr_filter,
-        source_fields=response_fields,
-    )
+    if ndjson:
+        return ndjson_response(
+            crud_materials.stream_many(
+                ancestor_id=noderef_id,
+                missing_attr_filter=missing_attr_filter,
+                source_fields=response_fields,
+            ),
+            LearningMaterial,
+            response_fields=response_fields,
+        )
 
-    response.headers["X-Total-Count"] = str(len(materials))
-    response.headers["X-Query-Count"] = str(len(context.get("elastic_queries")))
+    if pagination:
+        page = await crud_materials.get_page(
+            ancestor_id=noderef_id,
+            missing_attr_filter=missing_attr_filter,
+            source_fields=response_fields,
+            size=pagination.size,
+            cursor=pagination.cursor,
+        )
+        materials = pagination(page)
+    else:
+        materials = await crud_collection.get_child_materials_with_missing_attributes(
+            noderef_id=noderef_id,
+            missing_attr_filter=missing_attr_filter,
+            source_fields=response_fields,
+        )
+        response.headers["X-Total-Count"] = str(len(materials))
+
+    response.headers["X-Query-Count"] = str(query_count())
     return filter_response_fields(materials, response_fields=response_fields)
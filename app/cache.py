@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import inspect
+import json
+from enum import Enum
+from fnmatch import fnmatchcase
+from functools import wraps
+from time import monotonic
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    List,
+    Optional,
+    Union,
+    get_type_hints,
+)
+from uuid import UUID
+
+import aioredis
+from aioredis.exceptions import RedisError
+from fastapi.encoders import jsonable_encoder
+from pydantic import (
+    BaseModel,
+    parse_obj_as,
+)
+
+from app.core.config import (
+    CACHE_PREFIX,
+    CACHE_TTL,
+    CACHE_TTLS,
+    REDIS_URL,
+    SWR_CACHE_SOFT_TTL,
+)
+from app.core.logging import logger
+
+_redis: Union[aioredis.Redis, None] = None
+
+
+async def get_redis() -> Optional[aioredis.Redis]:
+    """
+    Returns the shared redis client, or `None` if no `REDIS_URL` is configured.
+
+    `REDIS_URL=fakeredis://` uses an in-process fakeredis server instead,
+    which requires the `fakeredis` package.
+    """
+    global _redis
+    if not _redis and REDIS_URL:
+        logger.debug("redis: Opening client")
+        if REDIS_URL.startswith("fakeredis://"):
+            from fakeredis.aioredis import FakeRedis
+
+            _redis = FakeRedis()
+        else:
+            _redis = aioredis.from_url(REDIS_URL)
+        logger.debug("redis: Opened client")
+    return _redis
+
+
+def use_redis(client: Optional[aioredis.Redis]):
+    """ Replaces the shared redis client, e.g. with a `fakeredis` instance """
+    global _redis
+    _redis = client
+
+
+async def close_redis():
+    global _redis
+    if _redis:
+        logger.debug("redis: Closing client")
+        await _redis.close()
+        _redis = None
+        logger.debug("redis: Closed client")
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return _normalize(value.value)
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return _normalize(value.dict())
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (set, frozenset)):
+        return sorted((_normalize(v) for v in value), key=json.dumps)
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def cache_key(namespace: str, params: dict) -> str:
+    digest = hashlib.sha1(
+        json.dumps(_normalize(params), sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"{CACHE_PREFIX}:{namespace}:{digest}"
+
+
+def cached(func: Callable) -> Callable:
+    """
+    Caches the results of an async crud function in redis, shared across workers.
+
+    Keys are derived from the function and its normalized parameters, so that
+    e.g. a set of fields given in a different order still hits the same entry.
+    The TTL is `CACHE_TTLS[namespace]` if configured, `CACHE_TTL` otherwise,
+    where the namespace is `<module>.<function>` (e.g. `stats.run_stats_scores`).
+    A TTL of 0 disables caching for the function. `None` results are not cached.
+
+    Values are stored as JSON and parsed into the return type of the function
+    when loaded, so the return annotation has to describe the result, e.g. its
+    pydantic models. Entries which cannot be loaded anymore are treated as
+    misses.
+    """
+    namespace = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+    ttl = CACHE_TTLS.get(namespace, CACHE_TTL)
+    signature = inspect.signature(func)
+    return_type = get_type_hints(func).get("return", Any)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        redis = await get_redis()
+        if not redis or not ttl:
+            return await func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = cache_key(namespace, bound.arguments)
+
+        try:
+            value = await redis.get(key)
+        except (RedisError, OSError) as e:
+            logger.warning(f"redis: Cache lookup failed for {namespace}: {e}")
+            return await func(*args, **kwargs)
+
+        if value is not None:
+            try:
+                return parse_obj_as(return_type, json.loads(value))
+            except Exception as e:
+                logger.warning(f"redis: Dropping unreadable entry {key}: {e}")
+
+        result = await func(*args, **kwargs)
+
+        if result is not None:
+            try:
+                value = json.dumps(jsonable_encoder(result, by_alias=False))
+                await redis.set(key, value, ex=ttl)
+            except (RedisError, OSError) as e:
+                logger.warning(f"redis: Cache update failed for {namespace}: {e}")
+
+        return result
+
+    wrapper.namespace = namespace
+    return wrapper
+
+
+async def invalidate(*namespaces: str) -> int:
+    """
+    Deletes the cached entries of the given namespaces, or all entries if none
+    are given, e.g. after the elastic index has been refreshed. This includes
+    the values of the stale-while-revalidate caches of the namespaces.
+
+    Returns the number of deleted entries.
+    """
+    patterns = namespaces or ("*",)
+
+    deleted = 0
+    for cache in _swr_caches:
+        matches = any(fnmatchcase(cache.namespace, p) for p in patterns)
+        if matches and cache.fetched_at is not None:
+            cache.invalidate()
+            deleted += 1
+
+    redis = await get_redis()
+    if not redis:
+        return deleted
+
+    for namespace in patterns:
+        keys = [key async for key in redis.scan_iter(f"{CACHE_PREFIX}:{namespace}:*")]
+        if keys:
+            deleted += await redis.delete(*keys)
+
+    logger.info(f"redis: Invalidated {deleted} cached entries")
+    return deleted
+
+
+class StaleWhileRevalidate:
+    """
+    In-memory cache for the result of an argument-less async function with
+    slowly changing results.
+
+    The cached value is served immediately. Once it is older than `soft_ttl`
+    seconds, it is refreshed in the background, while callers keep getting
+    the stale value. Only the very first call (unless warmed) waits for the
+    function. Failed refreshes are logged and the stale value is kept.
+    """
+
+    def __init__(self, func: Callable[[], Awaitable], soft_ttl: int):
+        self.func = func
+        self.namespace = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+        self.soft_ttl = soft_ttl
+        self.value = None
+        self.fetched_at: Optional[float] = None
+        self._refresh: Optional[asyncio.Task] = None
+        wraps(func)(self)
+
+    async def __call__(self):
+        if self.fetched_at is None:
+            # e.g. while the cache is being warmed
+            if self._refresh:
+                return await asyncio.shield(self._refresh)
+            return await self.refresh()
+
+        if monotonic() - self.fetched_at > self.soft_ttl:
+            self.revalidate()
+
+        return self.value
+
+    def revalidate(self):
+        """ Refreshes the value in the background, unless already refreshing """
+        if not self._refresh:
+            self._refresh = asyncio.ensure_future(self.refresh())
+            self._refresh.add_done_callback(self._refreshed)
+
+    async def refresh(self):
+        value = await self.func()
+        if value is not None:
+            self.value, self.fetched_at = value, monotonic()
+        return value
+
+    def _refreshed(self, task: asyncio.Task):
+        self._refresh = None
+        if not task.cancelled() and task.exception():
+            logger.warning(
+                f"Refreshing {self.func.__name__} failed, serving stale value: "
+                f"{task.exception()!r}"
+            )
+
+    def invalidate(self):
+        self.value, self.fetched_at = None, None
+
+
+_swr_caches: List[StaleWhileRevalidate] = []
+
+
+def stale_while_revalidate(
+    func: Optional[Callable] = None, soft_ttl: int = SWR_CACHE_SOFT_TTL
+):
+    def decorator(f: Callable) -> StaleWhileRevalidate:
+        cache = StaleWhileRevalidate(f, soft_ttl=soft_ttl)
+        _swr_caches.append(cache)
+        return cache
+
+    return decorator(func) if func else decorator
+
+
+async def warm_caches():
+    """
+    Fills all stale-while-revalidate caches concurrently in the background, e.g.
+    at startup, so that an unavailable backend does not delay it.
+    """
+    for cache in _swr_caches:
+        cache.revalidate()
@@ -3,6 +3,8 @@ import os
 from databases import DatabaseURL
 from starlette.datastructures import CommaSeparatedStrings
 
+from app.core.logging import logger
+
 ROOT_PATH = os.getenv("ROOT_PATH", "")
 API_KEY = os.getenv("API_KEY")
 API_KEY_NAME = "X-API-KEY"
@@ -19,12 +21,85 @@ BACKGROUND_TASK_SEARCH_STATS_INTERVAL = int(
 BACKGROUND_TASK_SPELLCHECK_INTERVAL = int(
     os.getenv("BACKGROUND_TASK_SPELLCHECK_INTERVAL", 0)
 )
-# sleep delay between subsequent search stats requests against elastic, default 500ms
+# runs import, dbt, search stats and spellcheck as dependent stages, instead of
+# the independent intervals above
+BACKGROUND_TASK_PIPELINE_INTERVAL = int(
+    os.getenv("BACKGROUND_TASK_PIPELINE_INTERVAL", 0)
+)
+# minimum sleep delay after each search stats _msearch request against elastic, the
+# delay is adapted to the latency of elastic
 BACKGROUND_TASK_SEARCH_STATS_SLEEP_INTERVAL = int(
     os.getenv("BACKGROUND_TASK_SEARCH_STATS_SLEEP_INTERVAL", 0)
 )
+# seconds after which the search stats of a title are refreshed, even if neither
+# the title nor the materials in the index have changed
+BACKGROUND_TASK_SEARCH_STATS_REFRESH_INTERVAL = int(
+    os.getenv("BACKGROUND_TASK_SEARCH_STATS_REFRESH_INTERVAL", 7 * 24 * 60 * 60)
+)
+# number of collection titles per _msearch request of the search stats, and the
+# maximum number of those requests in flight at once
+BACKGROUND_TASK_SEARCH_STATS_BATCH_SIZE = int(
+    os.getenv("BACKGROUND_TASK_SEARCH_STATS_BATCH_SIZE", 50)
+)
+BACKGROUND_TASK_SEARCH_STATS_CONCURRENCY = int(
+    os.getenv("BACKGROUND_TASK_SEARCH_STATS_CONCURRENCY", 4)
+)
+# number of texts read from the spellcheck queue at once, and the maximum number of
+# LanguageTool checks in flight at once
+BACKGROUND_TASK_SPELLCHECK_BATCH_SIZE = int(
+    os.getenv("BACKGROUND_TASK_SPELLCHECK_BATCH_SIZE", 200)
+)
+BACKGROUND_TASK_SPELLCHECK_CONCURRENCY = int(
+    os.getenv("BACKGROUND_TASK_SPELLCHECK_CONCURRENCY", 4)
+)
+# number of consumers claiming batches of the spellcheck queue concurrently in a run,
+# in addition to the consumers of other workers
+BACKGROUND_TASK_SPELLCHECK_WORKERS = int(
+    os.getenv("BACKGROUND_TASK_SPELLCHECK_WORKERS", 2)
+)
+# latencies in seconds of a search stats _msearch and a LanguageTool check above
+# which the sweeps back off, i.e. reduce their concurrency and increase their delay
+BACKGROUND_TASK_SEARCH_STATS_TARGET_LATENCY = float(
+    os.getenv("BACKGROUND_TASK_SEARCH_STATS_TARGET_LATENCY", 2)
+)
+BACKGROUND_TASK_SPELLCHECK_TARGET_LATENCY = float(
+    os.getenv("BACKGROUND_TASK_SPELLCHECK_TARGET_LATENCY", 1)
+)
+# seconds after which a running job without a heartbeat is considered lost, so jobs
+# of a crashed worker are queued again
+BACKGROUND_TASK_LEASE_TTL = int(os.getenv("BACKGROUND_TASK_LEASE_TTL", 120))
+# seconds between polls of the job worker for queued jobs, 0 disables the worker
+JOBS_POLL_INTERVAL = int(os.getenv("JOBS_POLL_INTERVAL", 5))
+# number of times a job is started before it is failed if its worker stops
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", 3))
+# number of rows per COPY statement when loading the analytics import into postgres
+ANALYTICS_IMPORT_BATCH_SIZE = int(os.getenv("ANALYTICS_IMPORT_BATCH_SIZE", 5000))
+# number of concurrent sliced scrolls each for collections and materials
+ANALYTICS_IMPORT_SLICES = int(os.getenv("ANALYTICS_IMPORT_SLICES", 4))
+# opt-in: store only the properties backing a resource field instead of all
+# properties, dbt models reading other properties get nulls; extra source fields
+# (e.g. "properties.cm:created") may be added comma separated
+ANALYTICS_IMPORT_PROJECTION = (
+    os.getenv("ANALYTICS_IMPORT_PROJECTION", "false").strip().lower() == "true"
+)
+ANALYTICS_IMPORT_EXTRA_FIELDS = list(
+    CommaSeparatedStrings(os.getenv("ANALYTICS_IMPORT_EXTRA_FIELDS", ""))
+)
+# import only resources modified since the last import, with a full import at
+# least every ANALYTICS_FULL_IMPORT_INTERVAL seconds; the overlap in seconds
+# covers resources which were modified before but indexed after the last import
+ANALYTICS_DELTA_IMPORT = (
+    os.getenv("ANALYTICS_DELTA_IMPORT", "false").strip().lower() == "true"
+)
+ANALYTICS_FULL_IMPORT_INTERVAL = int(os.getenv("ANALYTICS_FULL_IMPORT_INTERVAL", 86400))
+ANALYTICS_DELTA_IMPORT_OVERLAP = int(os.getenv("ANALYTICS_DELTA_IMPORT_OVERLAP", 600))
 
-DBT_URL = "http://dbt:8580/jsonrpc"
+DBT_URL = os.getenv("DBT_URL", "http://dbt:8580/jsonrpc")
+# dbt runs are polled in exponentially growing intervals (seconds) and killed
+# if they have not finished before the deadline
+DBT_POLL_INITIAL_INTERVAL = float(os.getenv("DBT_POLL_INITIAL_INTERVAL", 0.5))
+DBT_POLL_MAX_INTERVAL = float(os.getenv("DBT_POLL_MAX_INTERVAL", 30))
+DBT_RUN_DEADLINE = float(os.getenv("DBT_RUN_DEADLINE", 3600))
 LANGUAGETOOL_URL = "http://languagetool:8010/v2"
 ELASTICSEARCH_URL = os.getenv("ELASTICSEARCH_URL")
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -48,7 +123,52 @@ API_VERSION = os.getenv("API_VERSION", "v1")
 
 ELASTIC_INDEX = "workspace"
 ELASTIC_MAX_SIZE = 10000
+# default page size and point in time keep alive for cursor based pagination
+ELASTIC_PAGE_SIZE = int(os.getenv("ELASTIC_PAGE_SIZE", 1000))
+ELASTIC_PIT_KEEP_ALIVE = os.getenv("ELASTIC_PIT_KEEP_ALIVE", "1m")
+# elastic query/response bodies are kept per request and logged at debug level only
+# if the request is sampled or sends the capture header as "1" or "true" together
+# with a valid api key (any request in debug mode), up to a maximum of serialized
+# response bytes
+ELASTIC_QUERY_CAPTURE_HEADER = "X-Capture-Queries"
+ELASTIC_QUERY_CAPTURE_SAMPLE_RATE = float(
+    os.getenv("ELASTIC_QUERY_CAPTURE_SAMPLE_RATE", 0)
+)
+ELASTIC_QUERY_CAPTURE_MAX_BYTES = int(
+    os.getenv("ELASTIC_QUERY_CAPTURE_MAX_BYTES", 1_000_000)
+)
+# identical searches executed concurrently share a single request to elastic
+ELASTIC_COALESCE_QUERIES = (
+    os.getenv("ELASTIC_COALESCE_QUERIES", "true").strip().lower() == "true"
+)
 ELASTICSEARCH_TIMEOUT = int(os.getenv("ELASTICSEARCH_TIMEOUT", 20))
+# size of the connection pool per worker used by the async elasticsearch client
+ELASTICSEARCH_MAX_CONNECTIONS = int(os.getenv("ELASTICSEARCH_MAX_CONNECTIONS", 25))
+
+# shared response cache, disabled if no redis url is configured
+REDIS_URL = os.getenv("REDIS_URL")
+CACHE_PREFIX = "metaqs:cache"
+# default TTL in seconds
+CACHE_TTL = int(os.getenv("CACHE_TTL", 300))
+
+
+def _parse_cache_ttls(value: str) -> dict:
+    ttls = {}
+    for item in CommaSeparatedStrings(value):
+        namespace, _, ttl = item.partition("=")
+        try:
+            ttls[namespace.strip()] = int(ttl)
+        except ValueError:
+            logger.warning(f"Ignoring malformed CACHE_TTLS item: {item!r}")
+    return ttls
+
+
+# per function TTL overrides in seconds, malformed items are ignored, e.g.
+# CACHE_TTLS="stats.run_stats_scores=60,collection.get_many_sorted=3600"
+CACHE_TTLS = _parse_cache_ttls(os.getenv("CACHE_TTLS", ""))
+# seconds after which slowly changing reference data (portals, material types)
+# is refreshed in the background while the cached value is still being served
+SWR_CACHE_SOFT_TTL = int(os.getenv("SWR_CACHE_SOFT_TTL", 600))
 
 LANGUAGETOOL_ENABLED_CATEGORIES = [
     "TYPOGRAPHY",
@@ -57,6 +177,8 @@ LANGUAGETOOL_ENABLED_CATEGORIES = [
     "TYPOS",
     "COMPOUNDING",
 ]
+# seconds LanguageTool results are cached per text, 0 disables the cache
+LANGUAGETOOL_CACHE_TTL = int(os.getenv("LANGUAGETOOL_CACHE_TTL", 30 * 24 * 60 * 60))
 
 PORTAL_ROOT_ID = "5e40e372-735c-4b17-bbf7-e827a5702b57"
 PORTAL_ROOT_PATH = "/".join(
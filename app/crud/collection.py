@@ -1,25 +1,34 @@
 from typing import (
+    AsyncIterator,
     Dict,
     List,
     Optional,
     Set,
+    Tuple,
 )
 from uuid import UUID
 
-from elasticsearch_dsl.response import Response
 from pydantic import BaseModel
 
+from app.cache import (
+    cached,
+    stale_while_revalidate,
+)
 from app.core.config import (
     PORTAL_ROOT_ID,
     ELASTIC_MAX_SIZE,
+    ELASTIC_PAGE_SIZE,
 )
 from app.elastic import (
+    AsyncMultiSearch,
+    AsyncSearch,
+    CursorExpiredError,
     Field,
-    Search,
     abucketsort,
     qbool,
     qwildcard,
 )
+from app.elastic.utils import response_success
 from app.models.elastic import (
     DescendantCollectionsMaterialsCounts,
     ElasticResourceAttribute,
@@ -43,6 +52,10 @@ from .learning_material import (
     get_many as get_many_materials,
     MissingAttributeFilter as MissingMaterialAttributeFilter,
 )
+from .util import (
+    CursorExpiredException,
+    Page,
+)
 
 PORTALS = {
     # "Physik": {"value": "unknown"},
@@ -96,20 +109,21 @@ class MissingAttributeFilter(BaseModel):
         return query_dict
 
 
+@stale_while_revalidate
 async def get_portals():
-    s = Search().query(query_collections(ancestor_id=PORTAL_ROOT_ID))
+    s = AsyncSearch().query(query_collections(ancestor_id=PORTAL_ROOT_ID))
 
-    response: Response = s.source(
+    response = await s.source(
         [
             ElasticResourceAttribute.NODEREF_ID,
             CollectionAttribute.TITLE,
             CollectionAttribute.PATH,
             CollectionAttribute.PARENT_ID,
         ]
-    )[:ELASTIC_MAX_SIZE].execute()
+    )[:ELASTIC_MAX_SIZE].execute_raw()
 
-    if response.success():
-        collections = [Collection.parse_elastic_hit(hit) for hit in response]
+    if response_success(response):
+        collections = Collection.parse_elastic_hits(response["hits"]["hits"])
         return {
             c.noderef_id: c.title for c in collections if c.parent_id == PORTAL_ROOT_ID
         }
@@ -119,43 +133,118 @@ async def get_single(noderef_id: UUID) -> Collection:
     return Collection(noderef_id=noderef_id)
 
 
-async def get_many(
+def _get_many_search(
     ancestor_id: Optional[UUID] = None,
     missing_attr_filter: Optional[MissingAttributeFilter] = None,
     max_hits: Optional[int] = ELASTIC_MAX_SIZE,
     source_fields: Optional[Set[CollectionAttribute]] = None,
-) -> List[Collection]:
+) -> AsyncSearch:
     query_dict = get_many_base_query(
         resource_type=ResourceType.COLLECTION, ancestor_id=ancestor_id,
     )
     if missing_attr_filter:
         query_dict = missing_attr_filter.__call__(query_dict=query_dict)
-    s = Search().query(qbool(**query_dict))
+    s = AsyncSearch().query(qbool(**query_dict))
 
-    response = s.source(source_fields if source_fields else Collection.source_fields)[
+    return s.source(source_fields if source_fields else Collection.source_fields)[
         :max_hits
-    ].execute()
+    ]
 
-    if response.success():
-        return [Collection.parse_elastic_hit(hit) for hit in response]
 
+def _parse_many(response: dict) -> List[Collection]:
+    if response_success(response):
+        return Collection.parse_elastic_hits(response["hits"]["hits"])
 
-async def get_many_sorted(
-    root_noderef_id: UUID = PORTAL_ROOT_ID, size: int = ELASTIC_MAX_SIZE
+
+async def get_many(
+    ancestor_id: Optional[UUID] = None,
+    missing_attr_filter: Optional[MissingAttributeFilter] = None,
+    max_hits: Optional[int] = ELASTIC_MAX_SIZE,
+    source_fields: Optional[Set[CollectionAttribute]] = None,
 ) -> List[Collection]:
-    s = Search().query(query_collections(root_noderef_id))
+    response = await _get_many_search(
+        ancestor_id=ancestor_id,
+        missing_attr_filter=missing_attr_filter,
+        max_hits=max_hits,
+        source_fields=source_fields,
+    ).execute_raw()
+
+    return _parse_many(response)
+
+
+async def get_page(
+    ancestor_id: Optional[UUID] = None,
+    missing_attr_filter: Optional[MissingAttributeFilter] = None,
+    source_fields: Optional[Set[CollectionAttribute]] = None,
+    size: int = ELASTIC_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Page[Collection]:
+    try:
+        response, next_cursor = await _get_many_search(
+            ancestor_id=ancestor_id,
+            missing_attr_filter=missing_attr_filter,
+            max_hits=size,
+            source_fields=source_fields,
+        ).execute_page(cursor=cursor)
+    except CursorExpiredError:
+        raise CursorExpiredException()
+
+    if response_success(response):
+        return Page[Collection].construct(
+            items=_parse_many(response),
+            total=None if cursor else response["hits"]["total"]["value"],
+            cursor=next_cursor,
+        )
+
+
+async def stream_many(
+    ancestor_id: Optional[UUID] = None,
+    missing_attr_filter: Optional[MissingAttributeFilter] = None,
+    source_fields: Optional[Set[CollectionAttribute]] = None,
+) -> AsyncIterator[dict]:
+    s = _get_many_search(
+        ancestor_id=ancestor_id,
+        missing_attr_filter=missing_attr_filter,
+        max_hits=ELASTIC_PAGE_SIZE,
+        source_fields=source_fields,
+    )
 
-    response: Response = s.source(
+    async for hit in s.scan():
+        yield Collection.parse_elastic_hit_to_dict(hit)
+
+
+def _get_many_sorted_search(root_noderef_id: UUID, size: int) -> AsyncSearch:
+    s = AsyncSearch().query(query_collections(root_noderef_id))
+
+    return s.source(
         [
             ElasticResourceAttribute.NODEREF_ID,
             CollectionAttribute.TITLE,
             CollectionAttribute.PATH,
             CollectionAttribute.PARENT_ID,
         ]
-    ).sort(CollectionAttribute.FULLPATH)[:size].execute()
+    ).sort(CollectionAttribute.FULLPATH)[:size]
+
+
+@cached
+async def get_many_sorted(
+    root_noderef_id: UUID = PORTAL_ROOT_ID, size: int = ELASTIC_MAX_SIZE
+) -> List[Collection]:
+    response = await _get_many_sorted_search(
+        root_noderef_id=root_noderef_id, size=size
+    ).execute_raw()
+
+    if response_success(response):
+        return Collection.parse_elastic_hits(response["hits"]["hits"])
 
-    if response.success():
-        return [Collection.parse_elastic_hit(hit) for hit in response]
+
+async def stream_many_sorted(
+    root_noderef_id: UUID = PORTAL_ROOT_ID,
+) -> AsyncIterator[dict]:
+    s = _get_many_sorted_search(root_noderef_id=root_noderef_id, size=ELASTIC_PAGE_SIZE)
+
+    async for hit in s.scan():
+        yield Collection.parse_elastic_hit_to_dict(hit)
 
 
 # TODO: move to learning_material crud
@@ -188,15 +277,37 @@ async def get_child_collections_with_missing_attributes(
     )
 
 
-async def material_counts_by_descendant(
-    ancestor_id: UUID,
-) -> DescendantCollectionsMaterialsCounts:
-    s = Search().query(query_materials(ancestor_id=ancestor_id))
+def _material_counts_by_descendant_search(ancestor_id: UUID) -> AsyncSearch:
+    s = AsyncSearch().query(query_materials(ancestor_id=ancestor_id))
     s.aggs.bucket("grouped_by_collection", agg_materials_by_collection()).pipeline(
         "sorted_by_count", abucketsort(sort=[{"_count": {"order": "asc"}}]),
     )
+    return s[:0]
 
-    response: Response = s[:0].execute()
 
-    if response.success():
+def _parse_material_counts_by_descendant(
+    response: dict,
+) -> DescendantCollectionsMaterialsCounts:
+    if response_success(response):
         return DescendantCollectionsMaterialsCounts.parse_elastic_response(response)
+
+
+@cached
+async def get_many_with_material_counts(
+    ancestor_id: UUID, source_fields: Optional[Set[CollectionAttribute]] = None,
+) -> Tuple[List[Collection], DescendantCollectionsMaterialsCounts]:
+    """
+    Combines `get_many` and the material counts of the descendant collections
+    into a single `_msearch` round-trip.
+    """
+    collections_response, counts_response = await (
+        AsyncMultiSearch()
+        .add(_get_many_search(ancestor_id=ancestor_id, source_fields=source_fields))
+        .add(_material_counts_by_descendant_search(ancestor_id=ancestor_id))
+        .execute_raw()
+    )
+
+    return (
+        _parse_many(collections_response),
+        _parse_material_counts_by_descendant(counts_response),
+    )
@@ -1,9 +1,24 @@
+import hashlib
+from typing import (
+    Dict,
+    List,
+)
+
+from asyncpg import (
+    Pool,
+    PostgresError,
+)
 from httpx import AsyncClient
 
 from app.core.config import (
+    LANGUAGETOOL_CACHE_TTL,
     LANGUAGETOOL_ENABLED_CATEGORIES,
     LANGUAGETOOL_URL,
 )
+from app.core.logging import logger
+from app.pg.util import get_postgres_async
+
+_cache_table_created = False
 
 
 async def check_text(http: AsyncClient, text: str, language: str = "de-DE") -> dict:
@@ -16,11 +31,130 @@ async def check_text(http: AsyncClient, text: str, language: str = "de-DE") -> d
             "enabledOnly": "true",
         },
     )
+    response.raise_for_status()
 
     return response.json()
 
 
+async def check_text_cached(
+    http: AsyncClient, text: str, language: str = "de-DE"
+) -> dict:
+    """
+    Like `check_text`, but only checks texts without cached results. Texts are
+    checked without the cache if postgres is unavailable.
+    """
+    try:
+        pool = await get_postgres_async()
+    except (PostgresError, OSError) as e:
+        logger.warning(f"LanguageTool: cache unavailable: {e}")
+        return await check_text(http, text=text, language=language)
+
+    key = text_hash(text, language)
+    cached = await get_cached_results(pool, [key])
+    if key in cached:
+        return cached[key]
+
+    result = await check_text(http, text=text, language=language)
+    await cache_results(pool, {key: result})
+
+    return result
+
+
+def text_hash(text: str, language: str = "de-DE") -> str:
+    """
+    Cache key of the LanguageTool result of a text, which depends on the text,
+    its language and the enabled categories.
+    """
+    categories = ",".join(sorted(LANGUAGETOOL_ENABLED_CATEGORIES))
+    content = "\0".join([language, categories, text])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+async def get_cached_results(pool: Pool, keys: List[str]) -> Dict[str, dict]:
+    """ Returns the cached results of the `text_hash` keys which are cached """
+    if not LANGUAGETOOL_CACHE_TTL or not keys:
+        return {}
+
+    try:
+        async with pool.acquire() as conn:
+            await _create_cache_table(conn)
+            rows = await conn.fetch(
+                """
+                select hash, result from store.languagetool_cache
+                where hash = any($1::text[])
+                  and cached_at >= now() - make_interval(secs => $2)
+                """,
+                keys,
+                float(LANGUAGETOOL_CACHE_TTL),
+            )
+    except (PostgresError, OSError) as e:
+        logger.warning(f"LanguageTool: cache lookup failed: {e}")
+        return {}
+
+    return {row["hash"]: row["result"] for row in rows}
+
+
+async def cache_results(pool: Pool, results: Dict[str, dict]):
+    if not LANGUAGETOOL_CACHE_TTL or not results:
+        return
+
+    try:
+        async with pool.acquire() as conn:
+            await _create_cache_table(conn)
+            await conn.executemany(
+                """
+                insert into store.languagetool_cache (hash, result)
+                values ($1, $2)
+                on conflict (hash) do update
+                set result = excluded.result, cached_at = now()
+                """,
+                list(results.items()),
+            )
+    except (PostgresError, OSError) as e:
+        logger.warning(f"LanguageTool: cache update failed: {e}")
+
+
+async def purge_cache(pool: Pool) -> int:
+    """ Deletes the expired results, returns the number of deleted results """
+    if not LANGUAGETOOL_CACHE_TTL:
+        return 0
+
+    try:
+        async with pool.acquire() as conn:
+            await _create_cache_table(conn)
+            status = await conn.execute(
+                """
+                delete from store.languagetool_cache
+                where cached_at < now() - make_interval(secs => $1)
+                """,
+                float(LANGUAGETOOL_CACHE_TTL),
+            )
+    except (PostgresError, OSError) as e:
+        logger.warning(f"LanguageTool: cache purge failed: {e}")
+        return 0
+
+    # e.g. "DELETE 42"
+    return int(status.split()[-1])
+
+
 async def list_supported_languages(http: AsyncClient) -> list:
     response = await http.get(f"{LANGUAGETOOL_URL}/languages")
 
     return response.json()
+
+
+async def _create_cache_table(conn):
+    global _cache_table_created
+    if _cache_table_created:
+        return
+
+    await conn.execute(
+        """
+        create table if not exists store.languagetool_cache (
+            hash text primary key,
+            result jsonb not null,
+            cached_at timestamp not null default now()
+        );
+        """
+    )
+    _cache_table_created = True
@@ -1,5 +1,6 @@
 from random import randint
 from typing import (
+    AsyncIterator,
     List,
     Optional,
     Set,
@@ -8,15 +9,14 @@ from uuid import UUID
 
 from elasticsearch_dsl.function import RandomScore
 from elasticsearch_dsl.query import FunctionScore
-from elasticsearch_dsl.response import Response
-from glom import (
-    glom,
-    Iter,
-)
 from pydantic import BaseModel
 
+from app.cache import stale_while_revalidate
 # from app.core.util import slugify
-from app.core.config import ELASTIC_MAX_SIZE
+from app.core.config import (
+    ELASTIC_MAX_SIZE,
+    ELASTIC_PAGE_SIZE,
+)
 from .elastic import (
     ResourceType,
     agg_material_types,
@@ -24,12 +24,18 @@ from .elastic import (
     query_materials,
     query_missing_material_license,
 )
+from .util import (
+    CursorExpiredException,
+    Page,
+)
 from app.elastic import (
+    AsyncSearch,
+    CursorExpiredError,
     Field,
-    Search,
     qbool,
     qwildcard,
 )
+from app.elastic.utils import response_success
 from app.models.learning_material import (
     LearningMaterial,
     LearningMaterialAttribute,
@@ -66,32 +72,87 @@ class MissingAttributeFilter(BaseModel):
         return query_dict
 
 
-async def get_many(
+def _get_many_search(
     ancestor_id: Optional[UUID] = None,
     missing_attr_filter: Optional[MissingAttributeFilter] = None,
     source_fields: Optional[Set[LearningMaterialAttribute]] = None,
     max_hits: Optional[int] = ELASTIC_MAX_SIZE,
-) -> List[LearningMaterial]:
+) -> AsyncSearch:
     query_dict = get_many_base_query(
         resource_type=ResourceType.MATERIAL, ancestor_id=ancestor_id,
     )
     if missing_attr_filter:
         query_dict = missing_attr_filter.__call__(query_dict=query_dict)
-    s = Search().query(qbool(**query_dict))
+    s = AsyncSearch().query(qbool(**query_dict))
 
-    response = s.source(
+    return s.source(
         source_fields if source_fields else LearningMaterial.source_fields
-    )[:max_hits].execute()
+    )[:max_hits]
+
+
+async def get_many(
+    ancestor_id: Optional[UUID] = None,
+    missing_attr_filter: Optional[MissingAttributeFilter] = None,
+    source_fields: Optional[Set[LearningMaterialAttribute]] = None,
+    max_hits: Optional[int] = ELASTIC_MAX_SIZE,
+) -> List[LearningMaterial]:
+    response = await _get_many_search(
+        ancestor_id=ancestor_id,
+        missing_attr_filter=missing_attr_filter,
+        source_fields=source_fields,
+        max_hits=max_hits,
+    ).execute_raw()
+
+    if response_success(response):
+        return LearningMaterial.parse_elastic_hits(response["hits"]["hits"])
 
-    if response.success():
-        return [LearningMaterial.parse_elastic_hit(hit) for hit in response]
+
+async def get_page(
+    ancestor_id: Optional[UUID] = None,
+    missing_attr_filter: Optional[MissingAttributeFilter] = None,
+    source_fields: Optional[Set[LearningMaterialAttribute]] = None,
+    size: int = ELASTIC_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Page[LearningMaterial]:
+    try:
+        response, next_cursor = await _get_many_search(
+            ancestor_id=ancestor_id,
+            missing_attr_filter=missing_attr_filter,
+            source_fields=source_fields,
+            max_hits=size,
+        ).execute_page(cursor=cursor)
+    except CursorExpiredError:
+        raise CursorExpiredException()
+
+    if response_success(response):
+        return Page[LearningMaterial].construct(
+            items=LearningMaterial.parse_elastic_hits(response["hits"]["hits"]),
+            total=None if cursor else response["hits"]["total"]["value"],
+            cursor=next_cursor,
+        )
+
+
+async def stream_many(
+    ancestor_id: Optional[UUID] = None,
+    missing_attr_filter: Optional[MissingAttributeFilter] = None,
+    source_fields: Optional[Set[LearningMaterialAttribute]] = None,
+) -> AsyncIterator[dict]:
+    s = _get_many_search(
+        ancestor_id=ancestor_id,
+        missing_attr_filter=missing_attr_filter,
+        source_fields=source_fields,
+        max_hits=ELASTIC_PAGE_SIZE,
+    )
+
+    async for hit in s.scan():
+        yield LearningMaterial.parse_elastic_hit_to_dict(hit)
 
 
 async def get_random(
     ancestor_id: Optional[UUID] = None,
     source_fields: Optional[Set[LearningMaterialAttribute]] = None,
 ) -> LearningMaterial:
-    s = Search().query(
+    s = AsyncSearch().query(
         FunctionScore(
             query=query_materials(ancestor_id=ancestor_id),
             functions=RandomScore(seed=randint(1, 2 ** 32 - 1), field="_seq_no"),
@@ -99,36 +160,35 @@ async def get_random(
         )
     )
 
-    response = s.source(
+    response = await s.source(
         source_fields if source_fields else LearningMaterial.source_fields
-    )[:1].execute()
+    )[:1].execute_raw()
 
-    if response.success():
-        return LearningMaterial.parse_elastic_hit(response.hits[0])
+    if response_success(response):
+        return LearningMaterial.parse_elastic_hit(response["hits"]["hits"][0])
 
 
 async def material_count(ancestor_id: UUID) -> int:
-    s = Search().query(query_materials(ancestor_id=ancestor_id))
+    s = AsyncSearch().query(query_materials(ancestor_id=ancestor_id))
 
-    response: Response = s[:0].execute()
+    response = await s[:0].execute_raw()
 
-    if response.success():
-        return response.hits.total.value
+    if response_success(response):
+        return response["hits"]["total"]["value"]
 
 
+@stale_while_revalidate
 async def material_types() -> List[str]:
-    s = Search().query(query_materials())
+    s = AsyncSearch().query(query_materials())
     s.aggs.bucket("material_types", agg_material_types())
 
-    response: Response = s[:0].execute()
+    response = await s[:0].execute_raw()
 
-    if response.success():
-        # TODO: refactor algorithm
-        return glom(
-            response.aggregations.material_types.buckets,
-            # (Iter("key").map(lambda k: {slugify(k): k}).all(), merge,),
-            Iter("key").all(),
-        )
+    if response_success(response):
+        return [
+            bucket["key"]
+            for bucket in response["aggregations"]["material_types"]["buckets"]
+        ]
 
 
 # async def material_types_lut() -> dict:
@@ -1,16 +1,27 @@
 # import asyncio
 from collections import defaultdict
+from typing import (
+    List,
+    Optional,
+)
 from uuid import UUID
 
-from elasticsearch_dsl.response import Response
 from glom import merge
 
-from app.elastic import Search
+from app.cache import cached
+from app.elastic import (
+    AsyncMultiSearch,
+    AsyncSearch,
+    Search,
+    amax,
+)
 from app.elastic.utils import (
     merge_agg_response,
     merge_composite_agg_response,
+    response_success,
 )
 from app.crud.elastic import ResourceType
+from app.models.elastic import ElasticResourceAttribute
 from .elastic import (
     agg_materials_by_collection,
     agg_material_types,
@@ -23,34 +34,52 @@ from .elastic import (
 )
 
 
-async def run_stats_score(noderef_id: UUID, resource_type: ResourceType) -> dict:
+def _stats_score_search(noderef_id: UUID, resource_type: ResourceType) -> AsyncSearch:
     query, aggs = None, None
     if resource_type is ResourceType.COLLECTION:
         query, aggs = query_collections, aggs_collection_validation
     elif resource_type is ResourceType.MATERIAL:
         query, aggs = query_materials, aggs_material_validation
 
-    s = Search().query(query(ancestor_id=noderef_id))
+    s = AsyncSearch().query(query(ancestor_id=noderef_id))
     for name, _agg in aggs.items():
         s.aggs.bucket(name, _agg)
 
-    response: Response = s[:0].execute()
+    return s[:0]
+
 
-    if response.success():
+def _parse_stats_score(response: dict) -> dict:
+    if response_success(response):
         return {
-            "total": response.hits.total.value,
-            **{k: v["doc_count"] for k, v in response.aggregations.to_dict().items()},
+            "total": response["hits"]["total"]["value"],
+            **{k: v["doc_count"] for k, v in response["aggregations"].items()},
         }
 
 
+@cached
+async def run_stats_scores(
+    noderef_id: UUID, resource_types: List[ResourceType]
+) -> List[dict]:
+    ms = AsyncMultiSearch()
+    for resource_type in resource_types:
+        ms = ms.add(
+            _stats_score_search(noderef_id=noderef_id, resource_type=resource_type)
+        )
+
+    responses = await ms.execute_raw()
+
+    return [_parse_stats_score(response) for response in responses]
+
+
+@cached
 async def material_counts_by_type(root_noderef_id: UUID) -> dict:
-    s = Search().query(query_materials(ancestor_id=root_noderef_id))
+    s = AsyncSearch().query(query_materials(ancestor_id=root_noderef_id))
     s.aggs.bucket("material_types", agg_material_types_by_collection())
     s.aggs.bucket("totals", agg_materials_by_collection())
 
-    response: Response = s[:0].execute()
+    response = await s[:0].execute_raw()
 
-    if response.success():
+    if response_success(response):
 
         def fold_material_types(carry, bucket):
             material_type = bucket["key"]["material_type"]
@@ -62,13 +91,13 @@ async def material_counts_by_type(root_noderef_id: UUID) -> dict:
 
         # TODO: refactor algorithm
         stats = merge(
-            response.aggregations.material_types.buckets,
+            response["aggregations"]["material_types"]["buckets"],
             op=fold_material_types,
             init=lambda: defaultdict(dict),
         )
 
         totals = merge_composite_agg_response(
-            response.aggregations.totals, key="noderef_id"
+            response["aggregations"]["totals"], key="noderef_id"
         )
 
         for noderef_id, counts in stats.items():
@@ -77,13 +106,61 @@ async def material_counts_by_type(root_noderef_id: UUID) -> dict:
         return stats
 
 
-def search_hits_by_material_type(query_string: str) -> dict:
-    s = Search().query(query_materials()).query(search_materials(query_string))
+def _search_hits_by_material_type(s: Search, query_string: str) -> Search:
+    s = s.query(query_materials()).query(search_materials(query_string))
     s.aggs.bucket("material_types", agg_material_types())
+    return s[:0]
 
-    response: Response = s[:0].execute()
 
-    if response.success():
-        stats = merge_agg_response(response.aggregations.material_types)
-        stats["total"] = sum(stats.values())
-        return stats
+def _merge_hits_by_material_type(response: dict) -> dict:
+    stats = merge_agg_response(response["aggregations"]["material_types"])
+    stats["total"] = sum(stats.values())
+    return stats
+
+
+@cached
+async def search_hits_by_material_type(query_string: str) -> dict:
+    s = _search_hits_by_material_type(AsyncSearch(), query_string)
+
+    response = await s.execute_raw()
+
+    if response_success(response):
+        return _merge_hits_by_material_type(response)
+
+
+async def search_hits_by_material_types(
+    query_strings: List[str],
+) -> List[Optional[dict]]:
+    """
+    Batched variant for the search stats background task, which sends the
+    searches for all query strings in a single `_msearch` request.
+
+    Returns `None` for query strings whose search has failed.
+    """
+    ms = AsyncMultiSearch()
+    for query_string in query_strings:
+        ms = ms.add(_search_hits_by_material_type(AsyncSearch(), query_string))
+
+    responses = await ms.execute_raw(raise_on_error=False)
+
+    return [
+        _merge_hits_by_material_type(response)
+        if response and response_success(response)
+        else None
+        for response in responses
+    ]
+
+
+async def material_index_marker() -> str:
+    """
+    Marker of the state of the materials in the index, which changes whenever
+    materials are added, deleted or modified.
+    """
+    s = AsyncSearch().query(query_materials()).extra(track_total_hits=True)
+    s.aggs.metric("modified", amax(ElasticResourceAttribute.MODIFIED))
+
+    response = await s[:0].execute_raw()
+
+    total = response["hits"]["total"]["value"]
+    modified = response["aggregations"]["modified"]["value"]
+    return f"{total}:{modified}"
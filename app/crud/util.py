@@ -1,11 +1,20 @@
 from enum import Enum
-from typing import List
+from typing import (
+    Generic,
+    List,
+    Optional,
+    TypeVar,
+)
 from uuid import UUID
 
 from pydantic import BaseModel
+from pydantic.generics import GenericModel
 from sqlalchemy.sql import ClauseElement
 from starlette.exceptions import HTTPException
-from starlette.status import HTTP_404_NOT_FOUND
+from starlette.status import (
+    HTTP_404_NOT_FOUND,
+    HTTP_410_GONE,
+)
 
 from app.models.collection import (
     Collection,
@@ -28,6 +37,21 @@ class StatsNotFoundException(HTTPException):
         )
 
 
+class JobNotFoundException(HTTPException):
+    def __init__(self, job_id):
+        super().__init__(
+            status_code=HTTP_404_NOT_FOUND, detail=f"Job with id '{job_id}' not found",
+        )
+
+
+class CursorExpiredException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=HTTP_410_GONE,
+            detail="Cursor expired or invalid, restart the pagination without a cursor",
+        )
+
+
 class OrderByDirection(str, Enum):
     ASC = "ASC"
     DESC = "DESC"
@@ -46,6 +70,15 @@ class OrderByParams(BaseModel):
         return query
 
 
+PageItemT = TypeVar("PageItemT")
+
+
+class Page(GenericModel, Generic[PageItemT]):
+    items: List[PageItemT]
+    total: Optional[int] = None
+    cursor: Optional[str] = None
+
+
 async def build_portal_tree(
     collections: List[Collection], root_noderef_id: UUID
 ) -> List[PortalTreeNode]:
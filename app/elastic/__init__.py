@@ -14,6 +14,7 @@ from .dsl import (
     abucketsort,
     acomposite,
     afilter,
+    amax,
     amissing,
     aterms,
     qbool,
@@ -21,6 +22,7 @@ from .dsl import (
     qexists,
     qmatch,
     qnotexists,
+    qrange,
     qsimplequerystring,
     qterm,
     qterms,
@@ -31,4 +33,9 @@ from .fields import (
     Field,
     FieldType,
 )
-from .search import Search
+from .search import (
+    AsyncMultiSearch,
+    AsyncSearch,
+    CursorExpiredError,
+    Search,
+)
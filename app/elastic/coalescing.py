@@ -0,0 +1,60 @@
+import asyncio
+import json
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+)
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls into a single in-flight call.
+
+    Callers arriving while a call with the same key is running await its
+    result instead of starting their own, so results are never older than
+    the call they joined. The shared result must not be mutated by callers.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        call = self._calls.get(key)
+        if call is None:
+            self.executed += 1
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda f: self._done(key, f))
+        else:
+            self.coalesced += 1
+
+        # a cancelled caller must not cancel the call for everyone else
+        return await asyncio.shield(call)
+
+    def _done(self, key: str, call: asyncio.Future):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.cancelled():
+            # mark the exception as retrieved in case all callers were cancelled
+            call.exception()
+
+    def stats(self) -> dict:
+        total = self.executed + self.coalesced
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+            "coalesced_ratio": self.coalesced / total if total else 0.0,
+        }
+
+
+def query_key(index, body, params: dict) -> str:
+    return json.dumps(
+        {"index": index, "body": body, "params": params}, sort_keys=True, default=str
+    )
+
+
+elastic_queries = SingleFlight()
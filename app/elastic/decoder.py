@@ -0,0 +1,106 @@
+from enum import (
+    Enum,
+    auto,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+)
+
+from .fields import Field
+
+HitDecoder = Callable[[dict], dict]
+
+
+class DecodeKind(Enum):
+    REQUIRED = auto()
+    VALUE = auto()
+    VALUES = auto()
+    JOINED = auto()
+
+
+class FieldDecoder:
+    def __init__(self, field: Field, kind: DecodeKind, default: Any = None):
+        self.field = field
+        self.kind = kind
+        self.default = default
+
+    @property
+    def path(self) -> List[str]:
+        return self.field.path.split(".")
+
+
+def required(field: Field) -> FieldDecoder:
+    return FieldDecoder(field, DecodeKind.REQUIRED)
+
+
+def value(field: Field, default: Any = None) -> FieldDecoder:
+    return FieldDecoder(field, DecodeKind.VALUE, default=default)
+
+
+def values(field: Field) -> FieldDecoder:
+    return FieldDecoder(field, DecodeKind.VALUES)
+
+
+def joined(field: Field, separator: str = "\n") -> FieldDecoder:
+    return FieldDecoder(field, DecodeKind.JOINED, default=separator)
+
+
+_EMPTY: dict = {}
+
+
+def _as_list(v) -> list:
+    if v is None:
+        return []
+    if isinstance(v, (list, tuple)):
+        return list(v)
+    return [v]
+
+
+def compile_decoder(spec: Dict[str, FieldDecoder]) -> HitDecoder:
+    """
+    Compiles a spec of field decoders into a single function that extracts
+    all fields from an elastic `_source` dict in one pass.
+
+    Intermediate objects shared by several paths (e.g. `properties`)
+    are looked up only once per hit.
+    """
+    prefixes: Dict[tuple, str] = {}
+    lines = []
+
+    def lookup(path: List[str]) -> str:
+        parent = "source"
+        for i in range(1, len(path)):
+            prefix = tuple(path[:i])
+            if prefix not in prefixes:
+                prefixes[prefix] = f"_p{len(prefixes)}"
+                lines.append(
+                    f"    {prefixes[prefix]} = {parent}.get({path[i - 1]!r}) or _EMPTY"
+                )
+            parent = prefixes[prefix]
+        return parent
+
+    consts = {"_EMPTY": _EMPTY, "_as_list": _as_list}
+    items = []
+    for i, (name, decoder) in enumerate(spec.items()):
+        path = decoder.path
+        parent, key = lookup(path), path[-1]
+        if decoder.kind is DecodeKind.REQUIRED:
+            expr = f"{parent}[{key!r}]"
+        elif decoder.kind is DecodeKind.VALUE:
+            consts[f"_d{i}"] = decoder.default
+            expr = f"{parent}.get({key!r}, _d{i})"
+        elif decoder.kind is DecodeKind.VALUES:
+            expr = f"_as_list({parent}.get({key!r}))"
+        else:
+            consts[f"_d{i}"] = decoder.default
+            expr = f"_d{i}.join(_as_list({parent}.get({key!r})))"
+        items.append(f"        {name!r}: {expr},")
+
+    source = "\n".join(
+        ["def decode(source):", *lines, "    return {", *items, "    }"]
+    )
+    exec(compile(source, "<hit decoder>", "exec"), consts)
+    return consts["decode"]
@@ -42,6 +42,10 @@ def qwildcard(qfield: Union[Field, str], value: str) -> Query:
     return Q("wildcard", **{qfield: {"value": value}})
 
 
+def qrange(qfield: Union[Field, str], **kwargs) -> Query:
+    return Q("range", **{handle_text_field(qfield): kwargs})
+
+
 def qbool(**kwargs) -> Query:
     return Q("bool", **kwargs)
 
@@ -73,6 +77,10 @@ def amissing(qfield: Union[Field, str]) -> Agg:
     return A("missing", field=handle_text_field(qfield))
 
 
+def amax(qfield: Union[Field, str]) -> Agg:
+    return A("max", field=handle_text_field(qfield))
+
+
 def acomposite(sources: List[Union[Query, dict]], **kwargs) -> Agg:
     return A("composite", sources=sources, **kwargs)
 
@@ -1,16 +1,48 @@
 from pprint import pformat
+from time import perf_counter
+from typing import (
+    AsyncIterator,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
-from elasticsearch_dsl import Search as ElasticSearch
-from starlette_context import context
-from starlette_context.errors import ContextDoesNotExistError
+from elasticsearch.exceptions import (
+    NotFoundError,
+    RequestError,
+    TransportError,
+)
+from elasticsearch.helpers import scan
+from elasticsearch_dsl import (
+    MultiSearch as ElasticMultiSearch,
+    Search as ElasticSearch,
+)
+from elasticsearch_dsl.connections import get_connection
 
 from app.core.config import (
     DEBUG,
+    ELASTIC_COALESCE_QUERIES,
     ELASTIC_INDEX,
+    ELASTIC_PIT_KEEP_ALIVE,
 )
 from app.core.logging import logger
+from .coalescing import (
+    elastic_queries,
+    query_key,
+)
 from .fields import Field
-from .utils import handle_text_field
+from .tracing import trace_query
+from .utils import (
+    decode_cursor,
+    encode_cursor,
+    get_async_connection,
+    handle_text_field,
+)
+
+
+class CursorExpiredError(Exception):
+    """ The point in time of a cursor has expired or is not known to elastic """
 
 
 class Search(ElasticSearch):
@@ -29,21 +61,211 @@ class Search(ElasticSearch):
         return super(Search, self).sort(*[handle_text_field(key) for key in keys])
 
     def execute(self, ignore_cache=False):
-        if DEBUG:
-            logger.debug(f"Sending query to elastic:\n{pformat(self.to_dict())}")
+        self._log_query()
 
+        start = perf_counter()
         response = super(Search, self).execute(ignore_cache=ignore_cache)
 
+        self._log_response(response.to_dict(), duration=perf_counter() - start)
+
+        return response
+
+    def execute_raw(self) -> dict:
+        """
+        Executes the search and returns the decoded response body as plain
+        dicts and lists, without wrapping hits and buckets into
+        `AttrDict` objects.
+        """
+        self._log_query()
+
+        es = get_connection(self._using)
+        start = perf_counter()
+        response = es.search(index=self._index, body=self.to_dict(), **self._params)
+
+        self._log_response(response, duration=perf_counter() - start)
+
+        return response
+
+    def scan_raw(self) -> Iterator[dict]:
+        """
+        Like `scan`, but yields the raw hits as plain dicts.
+        """
+        self._log_query()
+
+        es = get_connection(self._using)
+        yield from scan(es, query=self.to_dict(), index=self._index, **self._params)
+
+    def _log_query(self):
+        if DEBUG:
+            logger.debug(f"Sending query to elastic:\n{pformat(self.to_dict())}")
+
+    def _log_response(
+        self, response: dict, duration: float, capture_response: bool = True
+    ):
         if DEBUG:
-            logger.debug(
-                f"Response received from elastic:\n{pformat(response.to_dict())}"
+            logger.debug(f"Response received from elastic:\n{pformat(response)}")
+
+        trace_query(self, response, duration, capture_response=capture_response)
+
+
+class AsyncSearch(Search):
+    """
+    Search executed through the pooled `AsyncElasticsearch` client,
+    so that queries do not block the event loop.
+    """
+
+    async def execute(self, ignore_cache=False):
+        if ignore_cache or not hasattr(self, "_response"):
+            self._response = self._response_class(self, await self.execute_raw())
+
+        return self._response
+
+    async def execute_raw(self) -> dict:
+        """
+        Identical searches executed concurrently share a single request
+        to elastic, see `ELASTIC_COALESCE_QUERIES`.
+        """
+        self._log_query()
+
+        es = get_async_connection()
+        body = self.to_dict()
+        start = perf_counter()
+        if ELASTIC_COALESCE_QUERIES:
+            response = await elastic_queries.do(
+                query_key(self._index, body, self._params),
+                lambda: es.search(index=self._index, body=body, **self._params),
+            )
+        else:
+            response = await es.search(index=self._index, body=body, **self._params)
+
+        self._log_response(response, duration=perf_counter() - start)
+
+        return response
+
+    async def execute_page(
+        self, cursor: Optional[str] = None, capture_response: bool = True
+    ) -> Tuple[dict, Optional[str]]:
+        """
+        Executes a single page of the search against a point in time (PIT)
+        using `search_after`, so that pages are consistent and not bounded
+        by `ELASTIC_MAX_SIZE`.
+
+        The page size is taken from the search (e.g. `s[:size]`).
+        Returns the raw response together with an opaque cursor to continue
+        after the last hit, or `None` once all hits have been returned.
+        Raises `CursorExpiredError` if the point in time of `cursor` is gone.
+        """
+        es = get_async_connection()
+
+        if cursor:
+            pit_id, search_after = decode_cursor(cursor)
+        else:
+            pit = await es.open_point_in_time(
+                index=self._index, keep_alive=ELASTIC_PIT_KEEP_ALIVE
             )
+            pit_id, search_after = pit["id"], None
+
+        # _shard_doc is the cheapest tiebreaker to resume after the last hit
+        s = self.sort(*self._sort, "_shard_doc").extra(
+            pit={"id": pit_id, "keep_alive": ELASTIC_PIT_KEEP_ALIVE},
+        )
+        if search_after:
+            s = s.extra(search_after=search_after)
+        else:
+            s = s.extra(track_total_hits=True)
 
+        s._log_query()
+
+        # searches against a PIT must not specify an index
+        start = perf_counter()
         try:
-            context["elastic_queries"] = context.get("elastic_queries", []) + [
-                {"query": self.to_dict(), "response": response.to_dict()}
+            response = await es.search(body=s.to_dict(), **s._params)
+        except (NotFoundError, RequestError) as e:
+            # an expired PIT is not found, a garbage PIT id is a bad request
+            if cursor:
+                raise CursorExpiredError(str(e)) from e
+            raise
+
+        s._log_response(
+            response, duration=perf_counter() - start, capture_response=capture_response
+        )
+
+        pit_id = response.get("pit_id", pit_id)
+        hits = response["hits"]["hits"]
+        if len(hits) < s._extra.get("size", 10):
+            await es.close_point_in_time(body={"id": pit_id})
+            return response, None
+
+        return response, encode_cursor(pit_id, hits[-1]["sort"])
+
+    async def scan(self) -> AsyncIterator[dict]:
+        """
+        Iterates over all raw hits of the search, page by page, without
+        keeping more than one page in memory. The page size is taken from
+        the search.
+        """
+        cursor = None
+        try:
+            while True:
+                response, cursor = await self.execute_page(
+                    cursor=cursor, capture_response=False
+                )
+                for hit in response["hits"]["hits"]:
+                    yield hit
+                if not cursor:
+                    break
+        finally:
+            if cursor:
+                pit_id, _ = decode_cursor(cursor)
+                await get_async_connection().close_point_in_time(body={"id": pit_id})
+
+
+class AsyncMultiSearch(ElasticMultiSearch):
+    """
+    Batch of searches sent to elastic in a single `_msearch` round-trip.
+
+    The responses are returned in the order the searches were added.
+    """
+
+    def __init__(self, index=ELASTIC_INDEX, **kwargs):
+        super(AsyncMultiSearch, self).__init__(index=index, **kwargs)
+
+    async def execute(self, ignore_cache=False, raise_on_error=True) -> List:
+        if ignore_cache or not hasattr(self, "_response"):
+            self._response = [
+                (s._response_class(s, r) if r is not None else None)
+                for s, r in zip(
+                    self._searches,
+                    await self.execute_raw(raise_on_error=raise_on_error),
+                )
             ]
-        except ContextDoesNotExistError:
-            pass
 
-        return response
+        return self._response
+
+    async def execute_raw(self, raise_on_error=True) -> List[Optional[dict]]:
+        for s in self._searches:
+            s._log_query()
+
+        es = get_async_connection()
+        body = self.to_dict()
+        start = perf_counter()
+        if ELASTIC_COALESCE_QUERIES:
+            responses = await elastic_queries.do(
+                query_key(self._index, body, self._params),
+                lambda: es.msearch(index=self._index, body=body, **self._params),
+            )
+        else:
+            responses = await es.msearch(index=self._index, body=body, **self._params)
+        duration = perf_counter() - start
+
+        out = []
+        for s, r in zip(self._searches, responses["responses"]):
+            if r.get("error", False):
+                if raise_on_error:
+                    raise TransportError("N/A", r["error"]["type"], r["error"])
+                r = None
+            else:
+                s._log_response(r, duration=duration)
+            out.append(r)
+
+        return out
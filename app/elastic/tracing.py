@@ -0,0 +1,127 @@
+import json
+import logging
+from random import random
+from typing import (
+    Any,
+    List,
+    Optional,
+    Union,
+)
+
+from starlette.requests import (
+    HTTPConnection,
+    Request,
+)
+from starlette.types import Message
+from starlette_context import context
+from starlette_context.errors import ContextDoesNotExistError
+from starlette_context.plugins import Plugin
+
+from app.core.config import (
+    API_KEY,
+    API_KEY_NAME,
+    DEBUG,
+    ELASTIC_QUERY_CAPTURE_HEADER,
+    ELASTIC_QUERY_CAPTURE_MAX_BYTES,
+    ELASTIC_QUERY_CAPTURE_SAMPLE_RATE,
+)
+from app.core.logging import logger
+
+QUERY_TRACE_KEY = "elastic_queries"
+
+
+class QueryTrace:
+    """
+    Per-request record of the queries sent to elastic.
+
+    By default only the elastic `took` and the measured round-trip duration
+    are kept for each query. Query and response bodies are captured only if
+    `capture` is set, up to `max_bytes` of serialized responses per request.
+    """
+
+    def __init__(
+        self, capture: bool = False, max_bytes: int = ELASTIC_QUERY_CAPTURE_MAX_BYTES
+    ):
+        self.capture = capture
+        self.max_bytes = max_bytes
+        self.captured_bytes = 0
+        self.queries: List[dict] = []
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def duration(self) -> float:
+        return sum(q["duration"] for q in self.queries)
+
+    def record(
+        self, search, response: dict, duration: float, capture_response: bool = True
+    ):
+        record = {"took": response.get("took"), "duration": duration}
+
+        if self.capture:
+            record["query"] = search.to_dict()
+            record["response"] = None
+            if capture_response:
+                size = len(json.dumps(response, default=str))
+                if self.captured_bytes + size <= self.max_bytes:
+                    self.captured_bytes += size
+                    record["response"] = response
+                else:
+                    record["truncated"] = True
+
+        self.queries.append(record)
+
+
+def get_query_trace() -> Optional[QueryTrace]:
+    try:
+        return context.get(QUERY_TRACE_KEY)
+    except ContextDoesNotExistError:
+        return None
+
+
+def trace_query(
+    search, response: dict, duration: float, capture_response: bool = True
+):
+    trace = get_query_trace()
+    if trace is not None:
+        trace.record(search, response, duration, capture_response=capture_response)
+
+
+def query_count() -> int:
+    trace = get_query_trace()
+    return len(trace) if trace is not None else 0
+
+
+class QueryTracePlugin(Plugin):
+    """
+    Opens a `QueryTrace` for each request. Bodies are captured if the
+    request is picked by the sampling rate or sends the capture header, which
+    is honored only together with a valid api key or in debug mode.
+    """
+
+    key = QUERY_TRACE_KEY
+
+    async def process_request(
+        self, request: Union[Request, HTTPConnection]
+    ) -> Optional[Any]:
+        header = request.headers.get(ELASTIC_QUERY_CAPTURE_HEADER, "")
+        requested = header.strip().lower() in ("1", "true") and (
+            DEBUG or (API_KEY and request.headers.get(API_KEY_NAME) == API_KEY)
+        )
+        capture = bool(requested) or random() < ELASTIC_QUERY_CAPTURE_SAMPLE_RATE
+        return QueryTrace(capture=capture)
+
+    async def enrich_response(self, arg: Message) -> None:
+        if arg["type"] != "http.response.start":
+            return
+
+        trace = get_query_trace()
+        if not trace:
+            return
+
+        logger.debug(
+            f"Elastic: {len(trace)} queries, {trace.duration * 1000:.1f} ms total"
+        )
+        if trace.capture and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Elastic queries:\n{json.dumps(trace.queries, default=str)}")
@@ -1,10 +1,24 @@
-from typing import Union
+import json
+from base64 import (
+    urlsafe_b64decode,
+    urlsafe_b64encode,
+)
+from binascii import Error as BinasciiError
+from typing import (
+    List,
+    Tuple,
+    Union,
+)
 
+import orjson
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
 from elasticsearch_dsl import connections
-from elasticsearch_dsl.response import AggResponse
 from glom import merge
 
 from app.core.config import (
+    ELASTICSEARCH_MAX_CONNECTIONS,
     ELASTICSEARCH_URL,
     ELASTICSEARCH_TIMEOUT,
 )
@@ -14,17 +28,51 @@ from .fields import (
     FieldType,
 )
 
+class FastJSONSerializer(JSONSerializer):
+    """ Decodes response bodies with `orjson` """
+
+    def loads(self, s):
+        try:
+            return orjson.loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+
+_async_client: Union[AsyncElasticsearch, None] = None
+
 
 async def connect_to_elastic():
     logger.debug(f"Attempt to open connection: {ELASTICSEARCH_URL}")
 
+    # sync connection, used by the analytics background tasks running in threads
     connections.create_connection(
-        hosts=[ELASTICSEARCH_URL], timeout=ELASTICSEARCH_TIMEOUT
+        hosts=[ELASTICSEARCH_URL],
+        timeout=ELASTICSEARCH_TIMEOUT,
+        serializer=FastJSONSerializer(),
     )
 
+    get_async_connection()
+
+
+def get_async_connection() -> AsyncElasticsearch:
+    global _async_client
+    if not _async_client:
+        logger.debug(f"Opening async connection: {ELASTICSEARCH_URL}")
+        _async_client = AsyncElasticsearch(
+            hosts=[ELASTICSEARCH_URL],
+            timeout=ELASTICSEARCH_TIMEOUT,
+            maxsize=ELASTICSEARCH_MAX_CONNECTIONS,
+            serializer=FastJSONSerializer(),
+        )
+    return _async_client
+
 
 async def close_elastic_connection():
-    pass
+    global _async_client
+    if _async_client:
+        logger.debug("Closing async connection to elastic")
+        await _async_client.close()
+        _async_client = None
 
 
 def handle_text_field(qfield: Union[Field, str]) -> str:
@@ -37,31 +85,49 @@ def handle_text_field(qfield: Union[Field, str]) -> str:
         return qfield
 
 
+def encode_cursor(pit_id: str, search_after: list) -> str:
+    payload = json.dumps({"pit_id": pit_id, "search_after": search_after})
+    return urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, List]:
+    try:
+        payload = json.loads(urlsafe_b64decode(cursor.encode()))
+        return payload["pit_id"], payload["search_after"]
+    except (BinasciiError, UnicodeError, ValueError, TypeError, KeyError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def response_success(response: dict) -> bool:
+    shards = response["_shards"]
+    return shards["total"] == shards["successful"] and not response["timed_out"]
+
+
 def merge_agg_response(
-    agg: AggResponse, key: str = "key", result_field: str = "doc_count"
+    agg: dict, key: str = "key", result_field: str = "doc_count"
 ) -> dict:
     def op(carry: dict, bucket: dict):
         carry[bucket[key]] = bucket[result_field]
 
-    return merge(agg.buckets, op=op)
+    return merge(agg["buckets"], op=op)
 
 
 def merge_composite_agg_response(
-    agg: AggResponse, key: str, result_field: str = "doc_count"
+    agg: dict, key: str, result_field: str = "doc_count"
 ) -> dict:
     def op(carry: dict, bucket: dict):
         carry[bucket["key"][key]] = bucket[result_field]
 
-    return merge(agg.buckets, op=op)
+    return merge(agg["buckets"], op=op)
 
 
 # def fold_agg_response(
-#     agg: AggResponse, key: str, result_field: str = "doc_count"
+#     agg: dict, key: str, result_field: str = "doc_count"
 # ) -> dict:
 #     return merge(agg)
 
 
 # def map_reduce_agg_response(
-#     agg: AggResponse, key: str, result_field: str = "doc_count"
+#     agg: dict, key: str, result_field: str = "doc_count"
 # ) -> dict:
 #     return merge(agg)
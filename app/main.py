@@ -8,16 +8,24 @@ from starlette_context.middleware import RawContextMiddleware
 
 import app.api as api
 from app.analytics.analytics import background_task as analytics_background_task
+from app.analytics.jobs import worker as jobs_worker
+from app.analytics.pipeline import background_task as pipeline_background_task
 from app.analytics.search_stats import background_task as search_stats_background_task
 from app.analytics.spellcheck import background_task as spellcheck_background_task
 from app.api.languagetool import router as languagetool_router
+from app.cache import (
+    close_redis,
+    warm_caches,
+)
 from app.core.config import (
     ALLOWED_HOSTS,
     API_VERSION,
     BACKGROUND_TASK_ANALYTICS_INTERVAL,
+    BACKGROUND_TASK_PIPELINE_INTERVAL,
     BACKGROUND_TASK_SEARCH_STATS_INTERVAL,
     BACKGROUND_TASK_SPELLCHECK_INTERVAL,
     DEBUG,
+    JOBS_POLL_INTERVAL,
     LOG_LEVEL,
     PROJECT_NAME,
     ROOT_PATH,
@@ -26,6 +34,7 @@ from app.core.errors import (
     http_422_error_handler,
     http_error_handler,
 )
+from app.elastic.tracing import QueryTracePlugin
 from app.elastic.utils import (
     close_elastic_connection,
     connect_to_elastic,
@@ -89,9 +98,10 @@ for route in fastapi_app.routes:
     if isinstance(route, APIRoute):
         route.operation_id = route.name
 
-fastapi_app.add_middleware(RawContextMiddleware)
+fastapi_app.add_middleware(RawContextMiddleware, plugins=(QueryTracePlugin(),))
 
 fastapi_app.add_event_handler("startup", connect_to_elastic)
+fastapi_app.add_event_handler("startup", warm_caches)
 fastapi_app.add_event_handler("shutdown", close_elastic_connection)
 
 if BACKGROUND_TASK_ANALYTICS_INTERVAL:
@@ -100,11 +110,16 @@ if BACKGROUND_TASK_SEARCH_STATS_INTERVAL:
     fastapi_app.add_event_handler("startup", search_stats_background_task)
 if BACKGROUND_TASK_SPELLCHECK_INTERVAL:
     fastapi_app.add_event_handler("startup", spellcheck_background_task)
+if BACKGROUND_TASK_PIPELINE_INTERVAL:
+    fastapi_app.add_event_handler("startup", pipeline_background_task)
+if JOBS_POLL_INTERVAL:
+    fastapi_app.add_event_handler("startup", jobs_worker)
 
 fastapi_app.add_exception_handler(HTTPException, http_error_handler)
 fastapi_app.add_exception_handler(HTTP_422_UNPROCESSABLE_ENTITY, http_422_error_handler)
 
 fastapi_app.add_event_handler("shutdown", close_client)
+fastapi_app.add_event_handler("shutdown", close_redis)
 
 app = CORSMiddleware(
     app=fastapi_app,
@@ -112,7 +127,7 @@ app = CORSMiddleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Total-Count"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor"],
 )
 
 
@@ -10,12 +10,11 @@ from typing import (
 )
 from uuid import UUID
 
-from glom import (
-    glom,
-    Coalesce,
-    Iter,
+from app.elastic.decoder import (
+    FieldDecoder,
+    value,
+    values,
 )
-
 from app.elastic.fields import (
     Field,
     FieldType,
@@ -67,34 +66,22 @@ class CollectionBase(ElasticResource):
         CollectionAttribute.PARENT_ID,
     }
 
-    @classmethod
-    def parse_elastic_hit_to_dict(cls: Type[_COLLECTION], hit: Dict,) -> dict:
-        spec = {
-            "title": Coalesce(CollectionAttribute.TITLE.path, default=None),
-            "keywords": (
-                Coalesce(CollectionAttribute.KEYWORDS.path, default=[]),
-                Iter().all(),
-            ),
-            "description": Coalesce(CollectionAttribute.DESCRIPTION.path, default=None),
-            "path": (
-                Coalesce(CollectionAttribute.PATH.path, default=[]),
-                Iter().all(),
-            ),
-            "parent_id": Coalesce(CollectionAttribute.PARENT_ID.path, default=None),
-        }
-        return {
-            **super(CollectionBase, cls).parse_elastic_hit_to_dict(hit),
-            **glom(hit, spec),
-        }
+    decoder_spec: ClassVar[Dict[str, FieldDecoder]] = {
+        "title": value(CollectionAttribute.TITLE),
+        "keywords": values(CollectionAttribute.KEYWORDS),
+        "description": value(CollectionAttribute.DESCRIPTION),
+        "path": values(CollectionAttribute.PATH),
+        "parent_id": value(CollectionAttribute.PARENT_ID),
+    }
 
     @classmethod
-    def parse_elastic_hit(cls: Type[_COLLECTION], hit: Dict,) -> _COLLECTION:
-        collection = cls.construct(**cls.parse_elastic_hit_to_dict(hit))
+    def parse_elastic_hit_to_dict(cls: Type[_COLLECTION], hit: Dict,) -> dict:
+        data = super(CollectionBase, cls).parse_elastic_hit_to_dict(hit)
         try:
-            collection.parent_id = collection.path[-1]
+            data["parent_id"] = data["path"][-1]
         except IndexError:
             pass
-        return collection
+        return data
 
 
 class Collection(ResponseModel, CollectionBase):
@@ -1,6 +1,7 @@
 from typing import (
     ClassVar,
     Dict,
+    Iterable,
     List,
     Optional,
     Type,
@@ -8,16 +9,19 @@ from typing import (
 )
 from uuid import UUID
 
-from elasticsearch_dsl.response import Response
+from elasticsearch_dsl.utils import AttrDict
 from pydantic import (
     BaseModel as PydanticBaseModel,
     Extra,
 )
-from glom import (
-    glom,
-    Coalesce,
-)
 
+from app.elastic.decoder import (
+    FieldDecoder,
+    HitDecoder,
+    compile_decoder,
+    required,
+    value,
+)
 from app.elastic.fields import (
     Field,
     FieldType,
@@ -42,6 +46,7 @@ class ElasticResourceAttribute(Field):
     KEYWORDS = ("properties.cclom:general_keyword", FieldType.TEXT)
     EDU_CONTEXT = ("properties.ccm:educationalcontext", FieldType.TEXT)
     EDU_CONTEXT_DE = ("i18n.de_DE.ccm:educationalcontext", FieldType.TEXT)
+    MODIFIED = ("properties.cm:modified", FieldType.KEYWORD)
 
 
 class ElasticConfig:
@@ -60,17 +65,34 @@ class ElasticResource(BaseModel):
         ElasticResourceAttribute.NAME,
     }
 
+    decoder_spec: ClassVar[Dict[str, FieldDecoder]] = {
+        "noderef_id": required(ElasticResourceAttribute.NODEREF_ID),
+        "type": value(ElasticResourceAttribute.TYPE),
+        "name": value(ElasticResourceAttribute.NAME),
+    }
+    _decode_hit: ClassVar[HitDecoder]
+
     class Config(ElasticConfig):
         pass
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compile_decoder()
+
+    @classmethod
+    def _compile_decoder(cls):
+        spec = {}
+        for klass in reversed(cls.__mro__):
+            spec.update(klass.__dict__.get("decoder_spec", {}))
+        cls._decode_hit = staticmethod(compile_decoder(spec))
+
     @classmethod
     def parse_elastic_hit_to_dict(cls: Type[_ELASTIC_RESOURCE], hit: Dict,) -> dict:
-        spec = {
-            "noderef_id": ElasticResourceAttribute.NODEREF_ID.path,
-            "type": Coalesce(ElasticResourceAttribute.TYPE.path, default=None),
-            "name": Coalesce(ElasticResourceAttribute.NAME.path, default=None),
-        }
-        return glom(hit, spec)
+        if isinstance(hit, AttrDict):
+            hit = hit.to_dict()
+        elif "_source" in hit:
+            hit = hit["_source"]
+        return cls._decode_hit(hit)
 
     @classmethod
     def parse_elastic_hit(
@@ -78,6 +100,16 @@ class ElasticResource(BaseModel):
     ) -> _ELASTIC_RESOURCE:
         return cls.construct(**cls.parse_elastic_hit_to_dict(hit))
 
+    @classmethod
+    def parse_elastic_hits(
+        cls: Type[_ELASTIC_RESOURCE], hits: Iterable[Dict],
+    ) -> List[_ELASTIC_RESOURCE]:
+        parse, construct = cls.parse_elastic_hit_to_dict, cls.construct
+        return [construct(**parse(hit)) for hit in hits]
+
+
+ElasticResource._compile_decoder()
+
 
 # TODO: eliminate
 class CollectionMaterialsCount(PydanticBaseModel):
@@ -96,17 +128,15 @@ class DescendantCollectionsMaterialsCounts(PydanticBaseModel):
 
     @classmethod
     def parse_elastic_response(
-        cls: Type[_DESCENDANT_COLLECTIONS_MATERIALS_COUNTS], response: Response,
+        cls: Type[_DESCENDANT_COLLECTIONS_MATERIALS_COUNTS], response: dict,
     ) -> _DESCENDANT_COLLECTIONS_MATERIALS_COUNTS:
-        results = glom(
-            response,
-            (
-                "aggregations.grouped_by_collection.buckets",
-                [{"noderef_id": "key.noderef_id", "materials_count": "doc_count"}],
-            ),
-        )
+        buckets = response["aggregations"]["grouped_by_collection"]["buckets"]
         return cls.construct(
             results=[
-                CollectionMaterialsCount.construct(**record) for record in results
+                CollectionMaterialsCount.construct(
+                    noderef_id=bucket["key"]["noderef_id"],
+                    materials_count=bucket["doc_count"],
+                )
+                for bucket in buckets
             ],
         )
@@ -4,18 +4,16 @@ from typing import (
     Dict,
     List,
     Optional,
-    Type,
-    TypeVar,
-)
-
-from glom import (
-    glom,
-    Coalesce,
-    Iter,
 )
 
 # from pydantic import HttpUrl
 
+from app.elastic.decoder import (
+    FieldDecoder,
+    joined,
+    value,
+    values,
+)
 from app.elastic.fields import (
     Field,
     FieldType,
@@ -27,8 +25,6 @@ from .elastic import (
 )
 from .util import EmptyStrToNone
 
-_LEARNING_MATERIAL = TypeVar("_LEARNING_MATERIAL")
-
 
 class _LearningMaterialAttribute(Field):
     TITLE = ("properties.cclom:title", FieldType.TEXT)
@@ -48,12 +44,18 @@ class _LearningMaterialAttribute(Field):
         "i18n.de_DE.ccm:oeh_lrt_aggregated",
         FieldType.TEXT,
     )
+    EDUENDUSERROLE = (
+        "properties.ccm:educationalintendedenduserrole",
+        FieldType.TEXT,
+    )
     EDUENDUSERROLE_DE = (
         "i18n.de_DE.ccm:educationalintendedenduserrole",
         FieldType.TEXT,
     )
     CONTAINS_ADS = ("properties.ccm:containsAdvertisement", FieldType.TEXT)
     OBJECT_TYPE = ("properties.ccm:objecttype", FieldType.TEXT)
+    REPLICATION_SOURCE = ("properties.ccm:replicationsource", FieldType.TEXT)
+    REPLICATION_SOURCE_ID = ("properties.ccm:replicationsourceid", FieldType.TEXT)
 
 
 LearningMaterialAttribute = Field(
@@ -87,36 +89,15 @@ class LearningMaterialBase(ElasticResource):
         LearningMaterialAttribute.LICENSES,
     }
 
-    @classmethod
-    def parse_elastic_hit_to_dict(cls: Type[_LEARNING_MATERIAL], hit: Dict,) -> dict:
-        spec = {
-            "title": Coalesce(LearningMaterialAttribute.TITLE.path, default=None),
-            "keywords": (
-                Coalesce(LearningMaterialAttribute.KEYWORDS.path, default=[]),
-                Iter().all(),
-            ),
-            "edu_context": (
-                Coalesce(LearningMaterialAttribute.EDU_CONTEXT.path, default=[]),
-                Iter().all(),
-            ),
-            "subjects": (
-                Coalesce(LearningMaterialAttribute.SUBJECTS.path, default=[]),
-                Iter().all(),
-            ),
-            "www_url": Coalesce(LearningMaterialAttribute.WWW_URL.path, default=None),
-            "description": (
-                Coalesce(LearningMaterialAttribute.DESCRIPTION.path, default=[]),
-                (Iter().all(), "\n".join),
-            ),
-            "licenses": (
-                Coalesce(LearningMaterialAttribute.LICENSES.path, default=[]),
-                (Iter().all(), "\n".join),
-            ),
-        }
-        return {
-            **super(LearningMaterialBase, cls).parse_elastic_hit_to_dict(hit),
-            **glom(hit, spec),
-        }
+    decoder_spec: ClassVar[Dict[str, FieldDecoder]] = {
+        "title": value(LearningMaterialAttribute.TITLE),
+        "keywords": values(LearningMaterialAttribute.KEYWORDS),
+        "edu_context": values(LearningMaterialAttribute.EDU_CONTEXT),
+        "subjects": values(LearningMaterialAttribute.SUBJECTS),
+        "www_url": value(LearningMaterialAttribute.WWW_URL),
+        "description": joined(LearningMaterialAttribute.DESCRIPTION),
+        "licenses": joined(LearningMaterialAttribute.LICENSES),
+    }
 
 
 class LearningMaterial(ResponseModel, LearningMaterialBase):
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark of the compiled hit decoders against the previous glom specs.
+
+Run from the project root with:
+
+    python -m benchmarks.hit_decoders
+"""
+import timeit
+
+from elasticsearch_dsl.response import Hit
+from glom import (
+    glom,
+    Coalesce,
+    Iter,
+)
+
+from app.models.learning_material import (
+    LearningMaterial,
+    LearningMaterialAttribute,
+)
+
+N_HITS = 10000
+REPEAT = 5
+
+_glom_spec = {
+    "noderef_id": LearningMaterialAttribute.NODEREF_ID.path,
+    "type": Coalesce(LearningMaterialAttribute.TYPE.path, default=None),
+    "name": Coalesce(LearningMaterialAttribute.NAME.path, default=None),
+    "title": Coalesce(LearningMaterialAttribute.TITLE.path, default=None),
+    "keywords": (
+        Coalesce(LearningMaterialAttribute.KEYWORDS.path, default=[]),
+        Iter().all(),
+    ),
+    "edu_context": (
+        Coalesce(LearningMaterialAttribute.EDU_CONTEXT.path, default=[]),
+        Iter().all(),
+    ),
+    "subjects": (
+        Coalesce(LearningMaterialAttribute.SUBJECTS.path, default=[]),
+        Iter().all(),
+    ),
+    "www_url": Coalesce(LearningMaterialAttribute.WWW_URL.path, default=None),
+    "description": (
+        Coalesce(LearningMaterialAttribute.DESCRIPTION.path, default=[]),
+        (Iter().all(), "\n".join),
+    ),
+    "licenses": (
+        Coalesce(LearningMaterialAttribute.LICENSES.path, default=[]),
+        (Iter().all(), "\n".join),
+    ),
+}
+
+
+def _hit(i: int) -> Hit:
+    return Hit(
+        {
+            "_id": str(i),
+            "_source": {
+                "nodeRef": {"id": f"00000000-0000-0000-0000-{i:012d}"},
+                "type": "ccm:io",
+                "properties": {
+                    "cm:name": f"material-{i}",
+                    "cclom:title": f"Material {i}",
+                    "cclom:general_keyword": ["Physik", "Mechanik", "Kraft"],
+                    "ccm:educationalcontext": ["Sekundarstufe I"],
+                    "ccm:taxonid": ["http://w3id.org/openeduhub/vocabs/discipline/460"],
+                    "cclom:general_description": [f"Beschreibung {i}"],
+                },
+            },
+        }
+    )
+
+
+def _glom_path(hits):
+    return [LearningMaterial.construct(**glom(hit, _glom_spec)) for hit in hits]
+
+
+def _compiled_path(hits):
+    return LearningMaterial.parse_elastic_hits(hits)
+
+
+def main():
+    hits = [_hit(i) for i in range(N_HITS)]
+
+    assert [m.dict() for m in _glom_path(hits[:10])] == [
+        m.dict() for m in _compiled_path(hits[:10])
+    ]
+
+    results = {}
+    for name, fn in [("glom", _glom_path), ("compiled", _compiled_path)]:
+        results[name] = min(timeit.repeat(lambda: fn(hits), number=1, repeat=REPEAT))
+        print(f"{name:>10}: {results[name] * 1000:8.1f} ms / {N_HITS} hits")
+
+    print(f"   speedup: {results['glom'] / results['compiled']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
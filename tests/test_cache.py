@@ -0,0 +1,43 @@
+import asyncio
+import json
+from typing import List
+from uuid import (
+    UUID,
+    uuid4,
+)
+
+import pytest
+
+import app.cache as cache
+from app.models.collection import Collection
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    monkeypatch.setattr(cache, "REDIS_URL", "fakeredis://")
+    cache.use_redis(None)
+    yield asyncio.run(cache.get_redis())
+    cache.use_redis(None)
+
+
+def test_cached_round_trip_parses_the_return_type(redis):
+    calls = []
+
+    @cache.cached
+    async def get_collections(ancestor_id: UUID) -> List[Collection]:
+        calls.append(ancestor_id)
+        return [Collection(noderef_id=ancestor_id, title="Physik")]
+
+    ancestor_id = uuid4()
+    miss = asyncio.run(get_collections(ancestor_id))
+    hit = asyncio.run(get_collections(ancestor_id))
+
+    assert calls == [ancestor_id]
+    assert hit == miss
+    assert isinstance(hit[0], Collection)
+    assert hit[0].noderef_id == ancestor_id
+
+    key = cache.cache_key(get_collections.namespace, {"ancestor_id": ancestor_id})
+    stored = json.loads(asyncio.run(redis.get(key)))
+    assert stored[0]["noderef_id"] == str(ancestor_id)
+    assert stored[0]["title"] == "Physik"